@@ -0,0 +1,388 @@
+#! /usr/bin/env python3
+'''
+Read the annotated tags and the commits of a git repository without running git.
+
+The refs come from packed-refs and the loose refs, and only the tag objects of the wanted tags are inflated,
+either from the loose objects or from the packfiles through their .idx index, including deltified objects.
+The commits are walked one at a time along their first parent, so a walk can stop at any known commit.
+Repositories with the SHA-256 object format or the reftable ref storage are not supported and raise GitError.
+'''
+import os
+import os.path
+import struct
+import zlib
+import datetime
+import collections
+
+object_types = {1: 'commit', 2: 'tree', 3: 'blob', 4: 'tag'}
+ofs_delta = 6
+ref_delta = 7
+signature_starts = (b'-----BEGIN PGP SIGNATURE-----', b'-----BEGIN PGP MESSAGE-----',
+                    b'-----BEGIN SSH SIGNATURE-----', b'-----BEGIN SIGNED MESSAGE-----')
+
+Commit = collections.namedtuple('Commit', ['tree', 'parents', 'author', 'authored', 'committed', 'message'])
+
+
+class GitError(Exception):
+    pass
+
+
+def git_dir(repo):
+    '''Find the git folder of a work tree, a linked work tree or a bare repo'''
+    gitdir = os.path.join(repo, '.git')
+    if os.path.isfile(gitdir):
+        with open(gitdir, 'rt') as fobj:
+            gitdir = os.path.join(repo, fobj.read().split(':', 1)[1].strip())
+    elif not os.path.isdir(gitdir):
+        gitdir = repo
+    commondir = os.path.join(gitdir, 'commondir')
+    if os.path.exists(commondir):
+        with open(commondir, 'rt') as fobj:
+            gitdir = os.path.join(gitdir, fobj.read().strip())
+    return gitdir
+
+
+class PackIndex:
+    '''Look up object offsets in a version 2 pack .idx file with a binary search over the mapped file'''
+    def __init__(self, filename):
+        import mmap
+        self.filename = filename
+        with open(filename, 'rb') as fobj:
+            self.data = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:8] != b'\377tOc\0\0\0\2':
+            raise GitError(f'unsupported pack index {filename}')
+        self.fanout = struct.unpack_from('>256I', self.data, 8)
+        self.count = self.fanout[255]
+        self.names = 8 + 256 * 4
+        self.offsets = self.names + self.count * 24
+        self.large_offsets = self.offsets + self.count * 4
+
+    def find(self, sha):
+        '''Return the pack offset of the binary sha or None'''
+        first = sha[0]
+        low = self.fanout[first - 1] if first else 0
+        high = self.fanout[first]
+        while low < high:
+            mid = (low + high) // 2
+            pos = self.names + mid * 20
+            name = self.data[pos:pos + 20]
+            if name < sha:
+                low = mid + 1
+            elif name > sha:
+                high = mid
+            else:
+                offset = struct.unpack_from('>I', self.data, self.offsets + mid * 4)[0]
+                if offset & 0x80000000:
+                    offset = struct.unpack_from('>Q', self.data, self.large_offsets + (offset & 0x7fffffff) * 8)[0]
+                return offset
+        return None
+
+    def close(self):
+        self.data.close()
+
+
+class Pack:
+    '''Read objects from a packfile, keeping the recently resolved delta bases like git does'''
+    cache_size = 256
+
+    def __init__(self, filename):
+        import mmap
+        self.cache = {}
+        self.index = PackIndex(filename[:-5] + '.idx')
+        with open(filename, 'rb') as fobj:
+            self.data = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:4] != b'PACK':
+            raise GitError(f'not a packfile {filename}')
+
+    def inflate(self, pos, size):
+        inflater = zlib.decompressobj()
+        res = []
+        chunk = max(size + 64, 4096)
+        while not inflater.eof:
+            data = self.data[pos:pos + chunk]
+            if not data:
+                raise GitError('truncated packfile')
+            res.append(inflater.decompress(data))
+            pos += len(data)
+        return b''.join(res)
+
+    def read(self, offset, repository):
+        '''Return the type and the data of the object at offset, resolving the delta chain'''
+        if offset not in self.cache:
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            self.cache[offset] = self.unpack(offset, repository)
+        return self.cache[offset]
+
+    def unpack(self, offset, repository):
+        pos = offset
+        byte = self.data[pos]
+        pos += 1
+        kind = (byte >> 4) & 7
+        size = byte & 15
+        shift = 4
+        while byte & 0x80:
+            byte = self.data[pos]
+            pos += 1
+            size |= (byte & 0x7f) << shift
+            shift += 7
+        if kind == ofs_delta:
+            byte = self.data[pos]
+            pos += 1
+            distance = byte & 0x7f
+            while byte & 0x80:
+                byte = self.data[pos]
+                pos += 1
+                distance = ((distance + 1) << 7) | (byte & 0x7f)
+            kind, base = self.read(offset - distance, repository)
+            return kind, apply_delta(base, self.inflate(pos, size))
+        if kind == ref_delta:
+            kind, base = repository.read(bytes(self.data[pos:pos + 20]).hex())
+            return kind, apply_delta(base, self.inflate(pos + 20, size))
+        if kind not in object_types:
+            raise GitError(f'unknown object type {kind}')
+        return object_types[kind], self.inflate(pos, size)
+
+    def close(self):
+        self.index.close()
+        self.data.close()
+
+
+def delta_size(delta, pos):
+    size = 0
+    shift = 0
+    while True:
+        byte = delta[pos]
+        pos += 1
+        size |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return size, pos
+
+
+def apply_delta(base, delta):
+    source_size, pos = delta_size(delta, 0)
+    target_size, pos = delta_size(delta, pos)
+    if source_size != len(base):
+        raise GitError('delta does not match its base')
+    res = bytearray()
+    while pos < len(delta):
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            offset = 0
+            size = 0
+            for bit in range(4):
+                if op & (1 << bit):
+                    offset |= delta[pos] << (bit * 8)
+                    pos += 1
+            for bit in range(3):
+                if op & (0x10 << bit):
+                    size |= delta[pos] << (bit * 8)
+                    pos += 1
+            res += base[offset:offset + (size or 0x10000)]
+        elif op:
+            res += delta[pos:pos + op]
+            pos += op
+        else:
+            raise GitError('invalid delta opcode')
+    if len(res) != target_size:
+        raise GitError('delta result has the wrong size')
+    return bytes(res)
+
+
+class Repository:
+    '''Read refs and objects straight from the files of a git repository'''
+    def __init__(self, repo):
+        self.gitdir = git_dir(repo)
+        if not os.path.isdir(os.path.join(self.gitdir, 'objects')):
+            raise GitError(f'{repo} is not a git repository')
+        self.check_format()
+        self.objectdirs = [os.path.join(self.gitdir, 'objects')]
+        alternates = os.path.join(self.gitdir, 'objects', 'info', 'alternates')
+        if os.path.exists(alternates):
+            with open(alternates, 'rt') as fobj:
+                self.objectdirs += [os.path.join(self.objectdirs[0], line.strip()) for line in fobj
+                                    if line.strip() and not line.startswith('#')]
+        self.packs = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def check_format(self):
+        config = os.path.join(self.gitdir, 'config')
+        if not os.path.exists(config):
+            return
+        with open(config, 'rt') as fobj:
+            for line in fobj:
+                key, _, value = [part.strip().lower() for part in line.partition('=')]
+                if key == 'objectformat' and value != 'sha1' or key == 'refstorage' and value != 'files':
+                    raise GitError(f'unsupported repository format {key} = {value}')
+
+    def refs(self, prefix='refs/tags/'):
+        '''Return the refs below prefix, with the prefix removed, and their sha'''
+        refs = {}
+        packed = os.path.join(self.gitdir, 'packed-refs')
+        if os.path.exists(packed):
+            with open(packed, 'rt') as fobj:
+                for line in fobj:
+                    if line.startswith(('#', '^')):
+                        continue
+                    sha, _, name = line.strip().partition(' ')
+                    if name.startswith(prefix):
+                        refs[name[len(prefix):]] = sha
+        top = os.path.join(self.gitdir, *prefix.split('/'))
+        for dirpath, dirnames, filenames in os.walk(top):
+            for filename in filenames:
+                with open(os.path.join(dirpath, filename), 'rt') as fobj:
+                    sha = fobj.read().strip()
+                if len(sha) == 40:
+                    name = os.path.relpath(os.path.join(dirpath, filename), top).replace(os.sep, '/')
+                    refs[name] = sha
+        return refs
+
+    def load_packs(self):
+        self.packs = []
+        for objectdir in self.objectdirs:
+            packdir = os.path.join(objectdir, 'pack')
+            if os.path.isdir(packdir):
+                self.packs += [Pack(os.path.join(packdir, name)) for name in sorted(os.listdir(packdir))
+                               if name.endswith('.pack') and os.path.exists(os.path.join(packdir, name[:-5] + '.idx'))]
+
+    def read(self, sha):
+        '''Return the type and the data of an object'''
+        for objectdir in self.objectdirs:
+            filename = os.path.join(objectdir, sha[:2], sha[2:])
+            if os.path.exists(filename):
+                with open(filename, 'rb') as fobj:
+                    header, _, data = zlib.decompress(fobj.read()).partition(b'\0')
+                return header.split(b' ', 1)[0].decode(), data
+        if self.packs is None:
+            self.load_packs()
+        binsha = bytes.fromhex(sha)
+        for pack in self.packs:
+            offset = pack.index.find(binsha)
+            if offset is not None:
+                return pack.read(offset, self)
+        raise GitError(f'object {sha} not found')
+
+    def ref(self, name='HEAD'):
+        '''Return the sha of a ref, following symbolic refs, or None'''
+        filename = os.path.join(self.gitdir, *name.split('/'))
+        if os.path.isfile(filename):
+            with open(filename, 'rt') as fobj:
+                value = fobj.read().strip()
+            if value.startswith('ref: '):
+                return self.ref(value[5:])
+            return value
+        packed = os.path.join(self.gitdir, 'packed-refs')
+        if os.path.exists(packed):
+            with open(packed, 'rt') as fobj:
+                for line in fobj:
+                    sha, _, refname = line.strip().partition(' ')
+                    if refname == name:
+                        return sha
+        return None
+
+    def tag(self, sha):
+        '''Return the name, tagger datetime and subject of an annotated tag, or None for other objects'''
+        kind, data = self.read(sha)
+        if kind != 'tag':
+            return None
+        headers, _, message = data.partition(b'\n\n')
+        fields = dict([line.split(b' ', 1) for line in headers.split(b'\n') if b' ' in line])
+        date = signature(fields[b'tagger'])[1] if b'tagger' in fields else None
+        return fields.get(b'tag', b'').decode(), date, subject(message)
+
+    def commit(self, sha):
+        '''Return the Commit with the author name, the author and committer datetimes and the raw message'''
+        kind, data = self.read(sha)
+        if kind != 'commit':
+            raise GitError(f'{sha} is a {kind}, not a commit')
+        headers, _, message = data.partition(b'\n\n')
+        tree = None
+        parents = []
+        author = authored = committed = None
+        for line in headers.split(b'\n'):
+            key, _, value = line.partition(b' ')
+            if key == b'tree':
+                tree = value.decode()
+            elif key == b'parent':
+                parents.append(value.decode())
+            elif key == b'author':
+                author, authored = signature(value)
+            elif key == b'committer':
+                committed = signature(value)[1]
+        return Commit(tree, parents, author, authored, committed, message)
+
+    def tree(self, sha):
+        '''Return the names of a tree object mapped to the sha of their object'''
+        kind, data = self.read(sha)
+        if kind != 'tree':
+            raise GitError(f'{sha} is a {kind}, not a tree')
+        entries = {}
+        pos = 0
+        while pos < len(data):
+            end = data.index(b'\0', pos)
+            name = data[pos:end].split(b' ', 1)[1].decode('utf-8', 'replace')
+            entries[name] = data[end + 1:end + 21].hex()
+            pos = end + 21
+        return entries
+
+    def walk(self, head, stop=None):
+        '''Yield the sha and the Commit from head back along the first parents, up to and without stop'''
+        sha = head
+        while sha and sha != stop:
+            commit = self.commit(sha)
+            yield sha, commit
+            sha = commit.parents[0] if commit.parents else None
+
+    def close(self):
+        for pack in self.packs or []:
+            pack.close()
+        self.packs = None
+
+
+def signature(value):
+    '''Split a "Name <email> timestamp offset" author, committer or tagger line into the name and its datetime'''
+    person, stamp, offset = value.rsplit(b' ', 2)
+    sign = -1 if offset.startswith(b'-') else 1
+    tz = datetime.timezone(sign * datetime.timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5])))
+    return person.split(b'<', 1)[0].strip().decode('utf-8', 'replace'), datetime.datetime.fromtimestamp(int(stamp), tz)
+
+
+def subject(message):
+    '''The first paragraph of a tag message without its signature, on one line as %(contents:subject)'''
+    lines = []
+    for line in message.split(b'\n'):
+        if line.startswith(signature_starts) or not line.strip():
+            break
+        lines.append(line.strip())
+    return b' '.join(lines).decode('utf-8', 'replace')
+
+
+def format_tag(name, tag):
+    '''Put the tag in the refname;taggerdate;subject layout of the netnextpredict.py tag_format'''
+    return f'{name};{tag[1].isoformat()};{tag[2]}'
+
+
+def tag_line(repository, name, sha):
+    '''Return the tag line of an annotated tag, or None for other objects'''
+    tag = repository.tag(sha)
+    return format_tag(name, tag) if tag and tag[1] else None
+
+
+def tag_lines(repo, match=None):
+    '''Return the tag lines of the repo sorted on the tagger date.  Only the tags whose name passes match are read'''
+    lines = []
+    with Repository(repo) as repository:
+        for name, sha in sorted(repository.refs().items()):
+            if match and not match(name):
+                continue
+            tag = repository.tag(sha)
+            if tag and tag[1]:
+                lines.append((tag[1], format_tag(name, tag)))
+    return [line for date, line in sorted(lines, key=lambda item: item[0])]
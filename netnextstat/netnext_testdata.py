@@ -4,6 +4,7 @@ Pull the Linux NetNext repo status and save it in a file
 
 Installation:
     pip --user install PyYAML
+    pip --user install numpy
 
 Service Installation:
     - Copy the netnextstatus.service and netnextstatus.timer to ~/.config/systemd/user
@@ -14,42 +15,219 @@ Service Installation:
     - Check output update: ls -l  ~/.local/share/netnextstatus/status.csv
     - Check output content: less  ~/.local/share/netnextstatus/status.csv
     - Run the service now: systemctl restart --user netnextstatus.service
+
+Status File:
+    - status.csv holds one start,last,state line per run of days with the same status
+    - A status.csv with the older one YAML entry per day is converted when it is read, and --to-yaml writes that
+      format again
+
+Synthetic Histories:
+    - Write a history store with 2000 jittered cycles for netnextpredict.py --outdir /tmp/bench --offline:
+      netnext_testdata.py --history /tmp/bench/history.sqlite --cycles 2000 --jitter 7 --interim 0.1
+    - A store is rewritten each time, while a .yaml history is only read by netnextpredict.py when there is no
+      history.sqlite next to it yet
 '''
 import os
 import os.path
 import argparse
+import bisect
 import datetime
+import numpy
 import yaml
 
+status_header = 'start,last,state'
+
 def load_datastore(filename):
-    return yaml.load(open(filename, 'rt'), Loader=yaml.FullLoader)
+    with open(filename, 'rt') as fobj:
+        return yaml.load(fobj, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
 
 def save_datastore(filename, data):
-    yaml.dump(data, open(filename, 'wt'))
+    import netnextpredict
+    netnextpredict.write_atomic(filename, yaml.dump(data, Dumper=getattr(yaml, 'CSafeDumper', yaml.SafeDumper)))
+
+class StatusRuns:
+    '''
+    The daily status as runs of days with the same state: a run lasts until the next run starts, and a None
+    state marks days without a status.  A day is found with a bisect over the run starts, and a day after the
+    last one extends the last run or starts a new one.  Changing an earlier day rebuilds the runs.
+    '''
+    def __init__(self):
+        self.starts = []
+        self.states = []
+        self.end = None
+
+    @classmethod
+    def from_daily(cls, data):
+        runs = cls()
+        for day in sorted(data):
+            runs.append(day, data[day])
+        return runs
+
+    @classmethod
+    def from_events(cls, dates, states, end=None):
+        '''Build the runs from the event arrays of generate_cycles()'''
+        runs = cls()
+        runs.starts = dates.tolist()
+        runs.states = numpy.where(states, 'Open', 'Closed').tolist()
+        runs.end = end or runs.starts[-1] + datetime.timedelta(days=1)
+        return runs
+
+    def __len__(self):
+        return len(self.starts)
+
+    def get(self, day):
+        idx = bisect.bisect_right(self.starts, day) - 1
+        if idx < 0 or day >= self.end:
+            return None
+        return self.states[idx]
+
+    def append(self, day, state):
+        '''Set the state of a day after the last day'''
+        if self.end is not None and day < self.end:
+            return self.set(day, state)
+        if self.end is not None and day > self.end:
+            self.starts.append(self.end)
+            self.states.append(None)
+        if not self.states or self.states[-1] != state or day > self.end:
+            self.starts.append(day)
+            self.states.append(state)
+        self.end = day + datetime.timedelta(days=1)
+
+    def set(self, day, state):
+        if self.end is None or day >= self.end:
+            return self.append(day, state)
+        data = self.to_daily()
+        data[day] = state
+        runs = StatusRuns.from_daily(data)
+        self.starts, self.states, self.end = runs.starts, runs.states, runs.end
 
-def generate_testdata(data):
-    day = datetime.timedelta(days=1)
-    current = datetime.date(2010, 1, 1)
+    def runs(self):
+        '''Return the first day, last day and state of each run with a status'''
+        ends = self.starts[1:] + [self.end]
+        return [(start, end - datetime.timedelta(days=1), state)
+                for start, end, state in zip(self.starts, ends, self.states) if state is not None]
+
+    def to_daily(self):
+        '''Return the status as the older dict with one entry per day'''
+        data = {}
+        for first, last, state in self.runs():
+            days = numpy.datetime64(first, 'D') + numpy.arange((last - first).days + 1)
+            data.update(dict.fromkeys(days.tolist(), state))
+        return data
+
+def load_status(filename):
+    '''Read the runs of a status.csv file, converting the older one entry per day YAML file'''
+    with open(filename, 'rt') as fobj:
+        first = fobj.readline().strip()
+        if first != status_header:
+            return StatusRuns.from_daily(load_datastore(filename) or {})
+        runs = StatusRuns()
+        for line in fobj:
+            start, last, state = line.strip().split(',', 2)
+            runs.append(datetime.date.fromisoformat(start), state)
+            runs.end = datetime.date.fromisoformat(last) + datetime.timedelta(days=1)
+    return runs
+
+def save_status(filename, runs):
+    import netnextpredict
+    lines = [status_header] + [f'{first},{last},{state}' for first, last, state in runs.runs()]
+    netnextpredict.write_atomic(filename, '\n'.join(lines) + '\n')
+
+def generate_testdata(data, open_days=51, closed_days=14, start=datetime.date(2010, 1, 1)):
     first = list(data.keys())[0]
-    opendays = range(0, 51)
-    closeddays = range(51, 65)
-    index = 0
-    while current < first:
-        if index in opendays:
-            data[current] = 'Open'
-        if index in closeddays:
-            data[current] = 'Closed'
-        current += day
-        index += 1
-        index %= 65
+    days = numpy.arange(max((first - start).days, 0))
+    states = numpy.where(days % (open_days + closed_days) < open_days, 'Open', 'Closed')
+    dates = numpy.datetime64(start, 'D') + days
+    data.update(zip(dates.tolist(), states.tolist()))
     return data
 
+def generate_cycles(cycles=1000, open_days=63, closed_days=14, jitter=0, interim=0.0, first=datetime.date(2000, 1, 3),
+                    seed=None):
+    '''
+    Draw a synthetic history of net-next cycles and return the event dates and a flag array that is True for the
+    openings.  Each period is jittered by up to jitter days, and with the interim probability a closed period gets
+    an interim opening that closes again a few days later.
+    '''
+    rng = numpy.random.default_rng(seed)
+    opens = numpy.maximum(open_days + rng.integers(-jitter, jitter + 1, cycles), 1)
+    closeds = numpy.maximum(closed_days + rng.integers(-jitter, jitter + 1, cycles), 1)
+    interims = (rng.random(cycles) < interim) & (closeds >= 3)
+    # The closed period is split into closed, interim open and closed again
+    before = rng.integers(1, numpy.maximum(closeds - 1, 2))
+    during = rng.integers(1, numpy.maximum(closeds - before, 2))
+    durations = numpy.stack([opens,
+                             numpy.where(interims, before, closeds),
+                             numpy.where(interims, during, 0),
+                             numpy.where(interims, closeds - before - during, 0)], axis=1)
+    mask = numpy.stack([numpy.ones(cycles, bool), numpy.ones(cycles, bool), interims, interims], axis=1).ravel()
+    starts = numpy.concatenate([[0], numpy.cumsum(durations.ravel())[:-1]])
+    dates = numpy.datetime64(first, 'D') + starts[mask]
+    states = numpy.tile([True, False, True, False], cycles)[mask]
+    return dates, states
+
+def generate_history(dates, states, author='Synthetic'):
+    '''Return the events in the history.yaml format of netnextpredict.py'''
+    names = numpy.where(states, 'Open', 'Closed').tolist()
+    return dict([(day, {'state': state, 'author': author}) for day, state in zip(dates.astype(str).tolist(), names)])
+
+def generate_events(dates, states, author='Synthetic'):
+    '''Return the events as the NetNextStateChange list that netnextpredict.py builds the cycles from'''
+    import netnextpredict
+    events = []
+    for day, state in zip(dates.tolist(), numpy.where(states, 'OPEN', 'CLOSED').tolist()):
+        events.append(netnextpredict.NetNextStateChange.from_fields(f'net-next is {state}', author,
+                                                                  datetime.datetime.combine(day, datetime.time())))
+    return events
+
+def generate_status(dates, states, end=None):
+    '''Expand the events to the daily status of the status.csv datastore'''
+    end = numpy.datetime64(end or dates[-1].tolist() + datetime.timedelta(days=1), 'D')
+    lengths = numpy.diff(numpy.append(dates, end)).astype(int)
+    days = numpy.datetime64(dates[0], 'D') + numpy.arange(lengths.sum())
+    return dict(zip(days.tolist(), numpy.repeat(numpy.where(states, 'Open', 'Closed'), lengths).tolist()))
+
+def save_history(filename, dates, states):
+    '''Write the events to a history store, or to a history.yaml when the filename is not a store'''
+    import netnextpredict
+    if not netnextpredict.is_history_store(filename):
+        return save_fast(filename, generate_history(dates, states))
+    with netnextpredict.HistoryStore(filename) as store:
+        store.replace(generate_events(dates, states))
+    print(f"... wrote {filename}")
+
+def save_fast(filename, data):
+    dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+    if os.path.dirname(filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'wt') as fobj:
+        yaml.dump(data, fobj, Dumper=dumper)
+    print(f"... wrote {filename}")
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
-    parser.add_argument('filename', help='Path to the datastore file', type=str, metavar='path', default='~/.local/share/netnextstatus/status.csv')
+    parser.add_argument('filename', help='Path to the datastore file', type=str, metavar='path', default='~/.local/share/netnextstatus/status.csv', nargs='?')
+    parser.add_argument('--history', help='Write a synthetic history store or history.yaml to this file', type=str, default=None)
+    parser.add_argument('--status', help='Write the synthetic history as a daily status file', type=str, default=None)
+    parser.add_argument('--cycles', help='Number of synthetic cycles', type=int, default=1000)
+    parser.add_argument('--open-days', help='Average number of days net-next is open', type=int, default=63)
+    parser.add_argument('--closed-days', help='Average number of days net-next is closed', type=int, default=14)
+    parser.add_argument('--jitter', help='Maximum number of days a period differs from the average', type=int, default=0)
+    parser.add_argument('--interim', help='Probability of an interim opening in a closed period', type=float, default=0.0)
+    parser.add_argument('--first', help='Date of the first opening', type=datetime.date.fromisoformat, default=datetime.date(2000, 1, 3))
+    parser.add_argument('--seed', help='Random seed', type=int, default=None)
+    parser.add_argument('--to-yaml', help='Write the status file as one YAML entry per day to this file', type=str, default=None)
     args = parser.parse_args()
-    if args.filename:
+    if args.history or args.status:
+        dates, states = generate_cycles(args.cycles, args.open_days, args.closed_days, args.jitter, args.interim,
+                                        args.first, args.seed)
+        if args.history:
+            save_history(os.path.expanduser(args.history), dates, states)
+        if args.status:
+            save_status(os.path.expanduser(args.status), StatusRuns.from_events(dates, states))
+    elif args.to_yaml:
+        save_datastore(os.path.expanduser(args.to_yaml), load_status(os.path.expanduser(args.filename)).to_daily())
+    elif args.filename:
         absfilename = os.path.expanduser(args.filename)
-        data = load_datastore(absfilename)
+        data = load_status(absfilename).to_daily()
         generate_testdata(data)
-        save_datastore(absfilename, data)
+        save_status(absfilename, StatusRuns.from_daily(data))
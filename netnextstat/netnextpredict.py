@@ -4,37 +4,80 @@ Read the lore.kernel.org netdev email list using a query to get the emails that
 Use that to show the historic net-next cycles and predict the next three.
 
 Installation:
-    pip install beautifulsoup4
+    pip install beautifulsoup4 (only needed with --html)
     pip install PyYAML
     pip install Jinja2
     pip install pytz
+    pip install numpy (only needed for the median, weighted and montecarlo models)
+    pip install Pillow (only needed for the resized and WebP background with --assets)
+    pip install brotli (only needed for the brotli encoded assets with --assets)
+
+Daemon Installation:
+    - Copy the netnextpredict.service to ~/.config/systemd/user and adjust the paths
+    - Reload: systemctl --user daemon-reload
+    - Enable and start the daemon: systemctl --user enable --now netnextpredict.service
+    - Check log: journalctl -xe --user -u netnextpredict.service
+
+Monitoring:
+    - Run with --profile /var/lib/node_exporter/textfile_collector/netnextpredict.prom to write the stage timings,
+      the downloaded bytes, the lore.kernel.org latency and the cache hits for the node exporter textfile collector
+    - Alert on netnextpredict_run_seconds, netnextpredict_lore_request_max_seconds or an old
+      netnextpredict_last_run_timestamp_seconds
+    - Add --cprofile netnextpredict.prof for a cProfile dump to read with python -m pstats
+
+Public-Inbox Mirror:
+    - Run with --inbox ~/mirrors/netdev to read a local public-inbox mirror of netdev, e.g. made with
+      public-inbox-clone https://lore.kernel.org/netdev, instead of the lore.kernel.org search
+    - Only the commits added since the last run are read: inboxcursor.yaml keeps the last commit of each epoch
+
+Announced Dates:
+    - Run with --announced to read the bodies of the announcements, e.g. "net-next will reopen on Dec 4th"
+    - The announced open and close dates are pinned in the prediction, and the bodies are kept in bodies.sqlite
+
+Multiple Trees:
+    - List the trees in a YAML file like trees.yaml and run with --trees trees.yaml
+    - The trees are fetched concurrently and each gets its page in its own outdir
+    - With --offline each tree uses the history saved in its outdir by an earlier run with --cached
 
 '''
 import sys
-import urllib.request
-import bs4
+import urllib.parse
+import threading
+import functools
+import bisect
 import re
 import datetime
 import os
 import os.path
-import argparse
-import yaml
-import pytz
-import jinja2
-import subprocess
 
 re_state = re.compile(r'net-next is (OPEN|CLOSED)', re.IGNORECASE)
 re_pull_rc1 = re.compile(r'\[GIT PULL\] Networking for ([0-9.]+-rc[1-2])', re.IGNORECASE)
 re_author = re.compile(r'-\sby\s([^@]+)\s@\s(\S+)\s+(\S+)\s+(\S+)\s+\[\d+%\]')
+# Look for the RC1 tags as they start a new Linux Version
+re_rc1_tag = re.compile(r'([^;]+)-rc1-.*;([^;]+);([^;]+)-rc1')
+tag_format = '%(refname:short);%(taggerdate:iso-strict);%(contents:subject)'
 
-history_limit = datetime.datetime.strptime('2018-08-28 15:43', '%Y-%m-%d %H:%M').date()
+lore_uri = 'https://lore.kernel.org/netdev/'
+state_query = 's:"net-next is "'
+pr_query = 's;"[GIT PULL] Networking for *"'
+lore_format = 'atom'
+lore_page_size = 200
+crawl_workers = 4
+
+history_limit = datetime.datetime.fromisoformat('2018-08-28 15:43').date()
+
+atom_ns = '{http://www.w3.org/2005/Atom}'
 
 
 class NetNextNotification:
+    # The Message-ID is only known for the messages read from lore.kernel.org, it is not saved with the history
+    __slots__ = ('_state', '_author', '_datetime', '_msgid')
+
     def __init__(self, subject, author):
         self._state = subject
         self._author = author
         self._datetime = datetime.datetime.now()
+        self._msgid = None
 
     def parse(self, regex, subject, author):
         self._state = regex.findall(subject)[0]
@@ -44,7 +87,22 @@ class NetNextNotification:
             self._datetime = datetime.datetime.strptime(f'{mt[0][1]} {mt[0][2]} {mt[0][3]}', '%Y-%m-%d %H:%M %Z')
         else:
             self._author = ''
-            self._datetime = datetime.datetime.strptime(author, '%Y-%m-%d')
+            self._datetime = datetime.datetime.fromisoformat(author)
+
+    @classmethod
+    def from_fields(cls, subject, author, when, regex=None, msgid=None):
+        item = cls.__new__(cls)
+        item._state = (regex or cls.regex).findall(subject)[0]
+        item._author = author
+        item._datetime = when
+        item._msgid = msgid
+        return item
+
+    @classmethod
+    def from_yaml(cls, datestr, values):
+        item = cls(f'net-next is {values["state"]}', str(datestr))
+        item._author = values.get('author', '')
+        return item
 
     @property
     def state(self):
@@ -54,6 +112,10 @@ class NetNextNotification:
     def date(self):
         return self._datetime.date()
 
+    @property
+    def msgid(self):
+        return self._msgid
+
     @property
     def yaml(self):
         return [str(self.date), {'state': self.state, 'author': self._author}]
@@ -69,25 +131,42 @@ class NetNextNotification:
 
 
 class NetNextStateChange(NetNextNotification):
-    def __init__(self, subject, author):
-        self.parse(re_state, subject, author)
+    __slots__ = ()
+    regex = re_state
+
+    def __init__(self, subject, author, regex=re_state, msgid=None):
+        self.parse(regex, subject, author)
+        self._msgid = msgid
 
 
 class NetNextPullRequest(NetNextNotification):
-    def __init__(self, subject, author):
-        self.parse(re_pull_rc1, subject, author)
+    __slots__ = ()
+    regex = re_pull_rc1
+
+    def __init__(self, subject, author, regex=re_pull_rc1, msgid=None):
+        self.parse(regex, subject, author)
+        self._msgid = msgid
 
 
 class NetNextCycle:
+    # Only the three dates are stored: the open and closed periods are derived from them
+    __slots__ = ('day1', 'day2', 'day3', 'version')
+    predicted = False
+
     def __init__(self, day1, day2, day3):
         self.day1 = day1
         self.day2 = day2
         self.day3 = day3
-        self.open = self.day2 - self.day1
-        self.closed = self.day3 - self.day2
-        self.predicted = False
         self.version = None
 
+    @property
+    def open(self):
+        return self.day2 - self.day1
+
+    @property
+    def closed(self):
+        return self.day3 - self.day2
+
     def set_version(self, version):
         self.version = version
 
@@ -108,35 +187,37 @@ class NetNextCycle:
 
 
 class PredictedNetNextCycle(NetNextCycle):
+    # Set by the montecarlo model: (low, high) dates and the probability of being open per date
+    __slots__ = ('day2_range', 'day3_range', 'probabilities')
+    predicted = True
+
     def __init__(self, day1, open_days, closed_days):
         self.day1 = day1
-        self.open = datetime.timedelta(days=open_days)
-        self.closed = datetime.timedelta(days=closed_days)
-        self.day2 = self.day1 + self.open
-        self.day3 = self.day2 + self.closed
-        self.predicted = True
+        self.day2 = self.day1 + datetime.timedelta(days=open_days)
+        self.day3 = self.day2 + datetime.timedelta(days=closed_days)
         self.version = None
+        self.day2_range = None
+        self.day3_range = None
+        self.probabilities = None
 
     def open_update(self, day2, today):
-        # print(f'open_update: {day2} {today}')
-        # Add one more day if net-next is still open today
-        while self.day2 <= today:
-            self.open += datetime.timedelta(days=1)
-            self.day2 = self.day1 + self.open
-            self.day3 = self.day2 + self.closed
+        # Move the closing forward to tomorrow if net-next is still open today
+        if self.day2 <= today:
+            shift = today - self.day2 + datetime.timedelta(days=1)
+            self.day2 += shift
+            self.day3 += shift
 
     def close_update(self, day2, today):
-        # print(f'close_update: {day2} {today}')
+        closed = self.closed
         self.day2 = day2
-        self.open = day2 - self.day1
-        self.day3 = self.day2 + self.closed
-        # Add one more day if net-next is still closed today
-        while self.day3 <= today:
-            self.closed += datetime.timedelta(days=1)
-            self.day3 = self.day2 + self.closed
+        self.day3 = self.day2 + closed
+        # Move the opening forward to tomorrow if net-next is still closed today
+        if self.day3 <= today:
+            self.day3 = today + datetime.timedelta(days=1)
 
 
 class LinuxTag:
+    __slots__ = ('date', 'tag', 'version')
     regex = re.compile(r'Linux (\d+)\.(\d+)')
 
     def __init__(self, date, tag, version):
@@ -144,8 +225,9 @@ class LinuxTag:
         self.tag = tag
         self.version = version
 
-    def increment(self):
-        mt = LinuxTag.regex.findall(self.version)
+    @staticmethod
+    def next_version(version):
+        mt = LinuxTag.regex.findall(version)
         if mt:
             major = int(mt[0][0])
             minor = int(mt[0][1])
@@ -154,100 +236,1322 @@ class LinuxTag:
                 minor = 0
             else:
                 minor += 1
-            self.version = f'Linux {major}.{minor}'
+            return f'Linux {major}.{minor}'
+        return version
+
+    def increment(self):
+        self.version = LinuxTag.next_version(self.version)
 
     def __str__(self):
         return f'{self.date}: {self.version}'
 
 
 def load_datastore(filename):
-    return yaml.load(open(filename, 'rt'), Loader=yaml.FullLoader)
-
-
-missing_data = [
-    NetNextStateChange('net-next is Open', '2019-05-20'),
-    NetNextStateChange('net-next is Closed', '2021-02-13'),
-    NetNextStateChange('net-next is Closed', '2021-04-24'),
-    NetNextStateChange('net-next is Open', '2021-05-12'),
-    NetNextStateChange('net-next is Closed', '2021-06-26'),
-    NetNextStateChange('net-next is Open', '2021-07-10'),
-    NetNextStateChange('net-next is Closed', '2021-08-28'),
-    NetNextStateChange('net-next is Closed', '2021-10-30'),
-    NetNextStateChange('net-next is Closed', '2022-01-11'),
-    NetNextStateChange('net-next is Closed', '2023-12-23'),  # Date announced by Jacub Kicinsky on Dec 05 2023
-]
+    import yaml
+    with open(filename, 'rt') as fobj:
+        return yaml.load(fobj, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
+def get_datastore_path(outdir, filename='history.sqlite'):
+    if outdir:
+        return os.path.join(os.path.expanduser(outdir), filename)
+    return filename
+
+
+class HistoryStore:
+    '''
+    Keep the history in an SQLite database indexed by date.
+    Saving only inserts the events after the last stored one, and a date range is read with one indexed query.
+    '''
+    def __init__(self, filename):
+        import sqlite3
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.execute('CREATE TABLE IF NOT EXISTS events '
+                        '(date TEXT PRIMARY KEY, state TEXT NOT NULL, author TEXT NOT NULL) WITHOUT ROWID')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def last(self):
+        '''Return the date of the last stored event or None'''
+        row = self.db.execute('SELECT max(date) FROM events').fetchone()
+        return datetime.date.fromisoformat(row[0]) if row[0] else None
+
+    def events(self, since=None, until=None):
+        '''Return the events from since to until, both included'''
+        rows = self.db.execute('SELECT date, state, author FROM events WHERE date >= ? AND date <= ? ORDER BY date',
+                               (str(since or ''), str(until or '9999')))
+        return [NetNextStateChange.from_fields(f'net-next is {state}', author, datetime.datetime.fromisoformat(day))
+                for day, state, author in rows]
+
+    @staticmethod
+    def rows(events):
+        return [(day, values['state'], values['author']) for day, values in [event.yaml for event in events]]
+
+    def append(self, events):
+        '''Store the events after the last stored one and return how many were added'''
+        last = self.last()
+        news = []
+        for event in reversed(events):
+            if last and event.date <= last:
+                break
+            news.append(event)
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO events VALUES (?, ?, ?)', self.rows(reversed(news)))
+        return len(news)
+
+    def replace(self, events):
+        '''Replace all the stored events, e.g. after a full fetch with new corrections'''
+        with self.db:
+            self.db.execute('DELETE FROM events')
+            self.db.executemany('INSERT OR REPLACE INTO events VALUES (?, ?, ?)', self.rows(events))
+        return len(events)
+
+    def export_yaml(self, filename):
+        save_yaml_history(filename, self.events())
+
+    def import_yaml(self, filename):
+        return self.replace(load_yaml_history(filename))
+
+
+def is_history_store(filename):
+    return os.path.splitext(filename)[1] in ['.sqlite', '.db']
+
+
+def load_yaml_history(filename):
+    if not os.path.exists(filename):
+        return []
+    data = load_datastore(filename) or {}
+    return sorted([NetNextStateChange.from_yaml(key, value) for key, value in data.items()])
+
+
+def load_history(filename, since=None, until=None):
+    '''
+    Load the history from a YAML file or from a history store.
+    A missing store is created from the YAML history next to it, so the history.yaml of older versions is kept.
+    '''
+    if not is_history_store(filename):
+        return load_yaml_history(filename)
+    if not os.path.exists(filename):
+        yamlname = f'{os.path.splitext(filename)[0]}.yaml'
+        if not os.path.exists(yamlname):
+            return []
+        with HistoryStore(filename) as store:
+            store.import_yaml(yamlname)
+    with HistoryStore(filename) as store:
+        return store.events(since, until)
+
+
+class MetricsStage:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        import time
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        import time
+        self.elapsed = time.perf_counter() - self.wall
+        self.metrics.observe(self.name, self.elapsed, time.thread_time() - self.cpu)
+
+
+class Metrics:
+    '''
+    Collect the wall and CPU time of the stages of a run, the downloaded bytes, the lore.kernel.org request
+    latency and the cache hits and misses, and write them as a Prometheus node exporter textfile.
+    The CPU time of a stage is the CPU time of the thread running it, and stages running in several threads
+    add up, so the time of a stage can be longer than the run.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        import time
+        with self.lock:
+            self.start = time.perf_counter()
+            self.stages = {}
+            self.counters = {}
+            self.gauges = {}
+            self.latency = []
+
+    def stage(self, name):
+        return MetricsStage(self, name)
+
+    def observe(self, name, wall, cpu=0.0):
+        with self.lock:
+            stage = self.stages.setdefault(name, [0.0, 0.0, 0])
+            stage[0] += wall
+            stage[1] += cpu
+            stage[2] += 1
+
+    def add(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def request(self, seconds):
+        with self.lock:
+            self.latency.append(seconds)
+
+    def textfile(self):
+        import time
+        prefix = 'netnextpredict'
+        lines = []
+
+        def metric(name, kind, text, samples):
+            lines.extend([f'# HELP {prefix}_{name} {text}', f'# TYPE {prefix}_{name} {kind}'])
+            for labels, value in samples:
+                labels = ','.join([f'{key}="{label}"' for key, label in labels])
+                lines.append(f'{prefix}_{name}{{{labels}}} {value}' if labels else f'{prefix}_{name} {value}')
+
+        with self.lock:
+            stages = sorted(self.stages.items())
+            metric('stage_seconds', 'gauge', 'Wall time spent in each stage of the last run',
+                   [((('stage', name),), value[0]) for name, value in stages])
+            metric('stage_cpu_seconds', 'gauge', 'CPU time spent in each stage of the last run',
+                   [((('stage', name),), value[1]) for name, value in stages])
+            metric('stage_calls', 'gauge', 'Number of times each stage ran in the last run',
+                   [((('stage', name),), value[2]) for name, value in stages])
+            metric('lore_request_seconds', 'summary', 'Time to the response headers of the lore.kernel.org requests', [])
+            lines.append(f'{prefix}_lore_request_seconds_sum {sum(self.latency)}')
+            lines.append(f'{prefix}_lore_request_seconds_count {len(self.latency)}')
+            metric('lore_request_max_seconds', 'gauge', 'Slowest lore.kernel.org request of the last run',
+                   [((), max(self.latency, default=0))])
+            names = sorted(set([name for name, labels in self.counters]))
+            for name in names:
+                metric(name, 'gauge', f'{name.replace("_", " ").capitalize()} in the last run',
+                       [(labels, value) for (key, labels), value in sorted(self.counters.items()) if key == name])
+            for name, value in sorted(self.gauges.items()):
+                metric(name, 'gauge', f'Number of {name} in the last run', [((), value)])
+            metric('run_seconds', 'gauge', 'Wall time of the last run', [((), time.perf_counter() - self.start)])
+            metric('cpu_seconds', 'gauge', 'CPU time of the process', [((), time.process_time())])
+            metric('last_run_timestamp_seconds', 'gauge', 'Time of the last run', [((), time.time())])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+        '''Write the textfile atomically, so the node exporter never reads a partial file'''
+        write_atomic(filename, self.textfile())
+        print(f"... wrote {filename}")
+
+
+metrics = Metrics()
+
+
+class HttpPool:
+    '''
+    Keep-alive HTTP(S) connections shared by the fetch threads: one connection per host and thread.
+    The crawl_workers fetch threads are kept from one crawl to the next, so their connections are reused.
+    The http_proxy, https_proxy and no_proxy settings of the environment are honored and redirects are followed.
+    Failed requests and 429 and 5xx answers are retried with an exponential backoff, and no request or read
+    goes past the deadline of the run: it raises TimeoutError instead.
+    '''
+    retry_statuses = (429, 500, 502, 503, 504)
+    redirect_statuses = (301, 302, 303, 307, 308)
+    max_redirects = 5
+
+    def __init__(self, timeout=60, retries=3, backoff=0.5):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.deadline = None
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+        self.workers = None
+
+    def executor(self):
+        '''The fetch threads, started on first use and kept until close'''
+        import concurrent.futures
+        with self.lock:
+            if self.workers is None:
+                self.workers = concurrent.futures.ThreadPoolExecutor(max_workers=crawl_workers,
+                                                                     thread_name_prefix='fetch')
+            return self.workers
+
+    def close(self):
+        '''Stop the fetch threads and close all the connections'''
+        with self.lock:
+            workers, self.workers = self.workers, None
+            connections, self.connections = self.connections, []
+        if workers:
+            workers.shutdown()
+        for conn in connections:
+            conn.close()
+        self.local = threading.local()
+
+    def set_deadline(self, seconds):
+        import time
+        self.deadline = time.monotonic() + seconds if seconds else None
+
+    def remaining(self):
+        '''Return the socket timeout for the next request or read'''
+        import time
+        if self.deadline is None:
+            return self.timeout
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError('the fetch deadline has passed')
+        return min(self.timeout, remaining)
+
+    def arm(self, uri):
+        '''Bound the next socket operation of the connection for uri by the deadline and return the connection'''
+        parts = urllib.parse.urlsplit(uri)
+        conn = self.connection(parts.scheme, parts.netloc)
+        conn.timeout = self.remaining()
+        if conn.sock:
+            conn.sock.settimeout(conn.timeout)
+        return conn
+
+    def wait(self, attempt):
+        import time
+        import random
+        delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+        if self.deadline is not None and time.monotonic() + delay >= self.deadline:
+            raise TimeoutError('the fetch deadline has passed')
+        metrics.add('lore_retries')
+        time.sleep(delay)
+
+    def connection(self, scheme, netloc):
+        import http.client
+        import urllib.request
+        connections = self.local.__dict__.setdefault('connections', {})
+        key = (scheme, netloc)
+        if key not in connections:
+            proxy = urllib.request.getproxies().get(scheme)
+            if proxy and not urllib.request.proxy_bypass(urllib.parse.urlsplit(f'//{netloc}').hostname or netloc):
+                conn = self.proxy_connection(scheme, netloc, proxy)
+            elif scheme == 'https':
+                conn = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(netloc, timeout=self.timeout)
+            connections[key] = conn
+            with self.lock:
+                self.connections.append(conn)
+        return connections[key]
+
+    def proxy_connection(self, scheme, netloc, proxy):
+        '''Tunnel https through the proxy with CONNECT, and send the http requests to it with the absolute URI'''
+        import base64
+        import http.client
+        parts = urllib.parse.urlsplit(proxy if '://' in proxy else f'http://{proxy}')
+        headers = {}
+        if parts.username:
+            credentials = f'{urllib.parse.unquote(parts.username)}:{urllib.parse.unquote(parts.password or "")}'
+            headers['Proxy-Authorization'] = f'Basic {base64.b64encode(credentials.encode()).decode()}'
+        if parts.scheme == 'https':
+            conn = http.client.HTTPSConnection(parts.hostname, parts.port, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=self.timeout)
+        conn.proxy_headers = {}
+        if scheme == 'https':
+            conn.set_tunnel(netloc, headers=headers)
+        else:
+            conn.proxy_headers = dict(headers, Host=netloc)
+        return conn
+
+    def request(self, uri, headers=None):
+        '''Send the request, following the redirects.  The response has the uri that answered as url'''
+        import http.client
+        for redirect in range(self.max_redirects + 1):
+            response = self.send(uri, headers)
+            location = response.getheader('Location')
+            if response.status not in self.redirect_statuses or not location:
+                response.url = uri
+                return response
+            response.read()
+            uri = urllib.parse.urljoin(uri, location)
+        raise http.client.HTTPException(f'too many redirects for {uri}')
+
+    def send(self, uri, headers=None):
+        import http.client
+        parts = urllib.parse.urlsplit(uri)
+        path = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        reconnected = False
+        attempt = 0
+        while True:
+            conn = self.arm(uri)
+            # A plain http proxy gets the absolute uri
+            proxy_headers = getattr(conn, 'proxy_headers', None)
+            target = uri if proxy_headers else path
+            try:
+                with metrics.stage('lore') as stage:
+                    conn.request('GET', target, headers=dict(proxy_headers or {}, **(headers or {})))
+                    response = conn.getresponse()
+                metrics.request(stage.elapsed)
+                if response.status not in self.retry_statuses or attempt >= self.retries:
+                    return response
+                response.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                conn.close()
+                if not reconnected:
+                    # The server closed an idle keep-alive connection: reconnect at once
+                    reconnected = True
+                    continue
+                if attempt >= self.retries:
+                    raise
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                if attempt >= self.retries:
+                    raise
+            self.wait(attempt)
+            attempt += 1
+
+    def get(self, uri, headers=None):
+        response = self.request(uri, headers)
+        self.arm(response.url)
+        with metrics.stage('lore'):
+            data = response.read()
+        metrics.add('downloaded_bytes', len(data))
+        return response.status, response.headers, data
+
+    def fetch(self, uri):
+        import urllib.error
+        status, headers, data = self.get(uri)
+        if status != 200:
+            raise urllib.error.HTTPError(uri, status, f'{status} from {uri}', headers, None)
+        return data
+
+    def open(self, uri, headers=None):
+        import urllib.error
+        response = self.request(uri, headers)
+        if response.status != 200:
+            response.read()
+            raise urllib.error.HTTPError(uri, response.status, f'{response.status} from {uri}', response.headers, None)
+        return response
+
+    def chunks(self, uri, size=65536):
+        yield from self.read_chunks(uri, self.open(uri), size)
+
+    def inflated_chunks(self, uri, size=65536):
+        '''Ask for a gzip encoded answer and inflate it chunk by chunk while it streams in'''
+        import zlib
+        response = self.open(uri, {'Accept-Encoding': 'gzip'})
+        if response.headers.get('Content-Encoding') != 'gzip':
+            yield from self.read_chunks(uri, response, size)
+            return
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        for chunk in self.read_chunks(uri, response, size):
+            yield inflater.decompress(chunk)
+        yield inflater.flush()
+
+    def read_chunks(self, uri, response, size):
+        while True:
+            self.arm(response.url)
+            with metrics.stage('lore'):
+                chunk = response.read(size)
+            if not chunk:
+                return
+            metrics.add('downloaded_bytes', len(chunk))
+            yield chunk
+
+
+pool = HttpPool()
+
+
+class FetchCache:
+    '''Keep the ETag and Last-Modified validators of the lore.kernel.org queries'''
+    def __init__(self, filename):
+        self.filename = filename
+        self.validators = {}
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(filename):
+            self.validators = load_datastore(filename) or {}
+
+    def fetch(self, uri):
+        import urllib.error
+        headers = {}
+        validator = self.validators.get(uri, {})
+        if 'etag' in validator:
+            headers['If-None-Match'] = validator['etag']
+        if 'last-modified' in validator:
+            headers['If-Modified-Since'] = validator['last-modified']
+        status, response_headers, data = pool.get(uri, headers)
+        if status == 304:
+            self.hits += 1
+            metrics.add('cache_hits', cache='lore')
+            return None
+        if status != 200:
+            raise urllib.error.HTTPError(uri, status, f'{status} from {uri}', response_headers, None)
+        validator = {}
+        if response_headers.get('ETag'):
+            validator['etag'] = response_headers['ETag']
+        if response_headers.get('Last-Modified'):
+            validator['last-modified'] = response_headers['Last-Modified']
+        self.validators[uri] = validator
+        self.misses += 1
+        metrics.add('cache_misses', cache='lore')
+        return data
+
+    def save(self):
+        import yaml
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        write_atomic(self.filename, yaml.dump(self.validators))
+
+
+class Corrections:
+    '''
+    The state changes that are missing on lore.kernel.org and the dates of the ones to ignore, both indexed by date.
+    They are read from a YAML file with a "missing" and an "excess" mapping of dates to states.
+    '''
+    def __init__(self, filename=None):
+        self.missing = {}
+        self.excess = {}
+        if filename and os.path.exists(filename):
+            data = load_datastore(filename) or {}
+            for key, state in (data.get('missing') or {}).items():
+                self.missing[datetime.date.fromisoformat(str(key))] = NetNextStateChange(f'net-next is {state}',
+                                                                                         str(key))
+            for key, state in (data.get('excess') or {}).items():
+                self.excess[datetime.date.fromisoformat(str(key))] = state
+
+    def remove_excess(self, history):
+        return [item for item in history if item.date not in self.excess]
+
+    def apply(self, history):
+        history = [item for item in history if item.date not in self.missing] + list(self.missing.values())
+        return sorted(self.remove_excess(history))
+
+
+corrections_path = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'corrections.yaml')
+
+
+@functools.lru_cache(maxsize=None)
+def load_corrections(filename=None):
+    return Corrections(filename or corrections_path)
+
+
+class NetNextTree:
+    '''
+    A *-next tree that announces when it opens and closes on a lore.kernel.org list.
+    The regex must have one group that captures OPEN or CLOSED.  With an inbox the messages are read from that
+    local public-inbox mirror of the list instead of the lore.kernel.org search.
+    '''
+    def __init__(self, name='net-next', uri=None, query=None, regex=None, corrections=None, outdir='.', title=None,
+                 inbox=None):
+        self.name = name
+        self.inbox = inbox
+        self.uri = uri or lore_uri
+        self.query = query or state_query
+        self.regex = re.compile(regex, re.IGNORECASE) if isinstance(regex, str) else regex or re_state
+        self.corrections = corrections or load_corrections()
+        self.outdir = outdir
+        self.title = title or 'NetNext'
+
+    @classmethod
+    def from_config(cls, filename):
+        '''Read the trees from a YAML file with a "trees" list: the corrections, outdir and inbox are relative to it'''
+        data = load_datastore(filename) or {}
+        dirname = os.path.dirname(os.path.abspath(filename))
+        trees = []
+        for item in data.get('trees', []):
+            corrections = None
+            if item.get('corrections'):
+                corrections = Corrections(os.path.join(dirname, os.path.expanduser(item['corrections'])))
+            inbox = os.path.join(dirname, os.path.expanduser(item['inbox'])) if item.get('inbox') else None
+            trees.append(cls(item['name'], item.get('uri'), item.get('query'), item.get('regex'),
+                             corrections or Corrections(), os.path.join(dirname, os.path.expanduser(item['outdir'])),
+                             item.get('title', item['name']), inbox))
+        return trees
+
+
+def get_updated_history(tree=None):
+    tree = tree or NetNextTree()
+    return tree.corrections.apply(get_netnext_history(tree))
+
+
+def get_cached_history(datastorepath, tree=None):
+    '''
+    Start from the saved history and only ask lore.kernel.org for the messages that arrived since the last saved
+    event.  The query is sent as a conditional request so an unchanged result costs a 304 and no parsing.
+    Returns the history and a flag telling if it differs from the saved history.
+    '''
+    tree = tree or NetNextTree()
+    stored = load_history(datastorepath)
+    if not stored:
+        return get_updated_history(tree), True
+    cache = FetchCache(os.path.join(os.path.dirname(datastorepath), 'fetchcache.yaml'))
+    history, changed = update_history(stored, cache, tree)
+    cache.save()
+    return history, changed
+
+
+def update_history(stored, cache, tree=None):
+    '''Merge the lore.kernel.org messages newer than the last stored event into the stored history'''
+    tree = tree or NetNextTree()
+    since = stored[-1].date
+    html = cache.fetch(lore_query_uri(tree.query, since, uri=tree.uri))
+    if html is None:
+        return stored, False
+    known = set([item.date for item in stored])
+    news = [item for item in tree.corrections.remove_excess(parse_netnext_history(html, tree.regex))
+            if item.date not in known]
+    if not news:
+        return stored, False
+    return sorted(stored + news), True
+
+
+def save_yaml_history(filename, data):
+    import yaml
+    dirname = os.path.dirname(filename)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+    history = dict([item.yaml for item in data])
+    write_atomic(filename, yaml.dump(history, Dumper=getattr(yaml, 'CSafeDumper', yaml.SafeDumper)))
+    print(f"... wrote {filename}")
 
-excess_data = [
-    NetNextStateChange('net-next is Open', '2024-01-02'),    # Interim opened
-    NetNextStateChange('net-next is Closed', '2023-12-23'),  # Date announced by Jacub Kicinsky on Dec 05 2023
-]
 
+def save_datastore(filename, data, replace=False):
+    '''Save the sorted history: a history store only gets the events after the last stored one unless replace'''
+    if not is_history_store(filename):
+        return save_yaml_history(filename, data)
+    with HistoryStore(filename) as store:
+        added = store.replace(data) if replace else store.append(data)
+    if added:
+        print(f"... wrote {added} events to {filename}")
 
-def get_updated_history():
-    history = get_netnext_history() + missing_data
-    for idx, event in enumerate(history):
-        for evt in excess_data:
-            if event.date == evt.date:
-                del history[idx]
-    return sorted(history)
 
+def lore_query_uri(query, since=None, offset=0, uri=None):
+    if since:
+        query += f' d:{since.strftime("%Y%m%d")}..'
+    uri = f'{uri or lore_uri}?q={urllib.parse.quote_plus(query)}'
+    if offset:
+        uri += f'&o={offset}'
+    if lore_format == 'atom':
+        uri += '&x=A'
+    return uri
 
-def save_datastore(filename, data):
-    dirname = os.path.dirname(filename)
-    if not os.path.exists(dirname):
-        os.makedirs(dirname)
-    history = dict([item.yaml for item in data])
-    yaml.dump(history, open(filename, 'wt'))
-    print(f"... wrote {filename}")
 
+@functools.lru_cache(maxsize=4096)
+def parse_lore_date(text):
+    when = datetime.datetime.fromisoformat(text)
+    if when.tzinfo:
+        when = when.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return when
 
-def get_netnext_history():
-    res = []
-    uri = 'https://lore.kernel.org/netdev/?q=s%3A%22net-next+is+%22'
-    with urllib.request.urlopen(uri) as response:
-        html = response.read()
-        parsed_html = bs4.BeautifulSoup(html, 'html.parser')
-        for item in parsed_html.find_all('a'):
-            if re_state.search(item.text) and 'Re:' not in item.text:
-                state = NetNextStateChange(item.text, item.parent.next_sibling)
-                if state.date >= history_limit:
-                    res.append(state)
-    return res
+
+def message_id(href):
+    '''The Message-ID of a lore.kernel.org message link, like https://lore.kernel.org/netdev/<Message-ID>/'''
+    return urllib.parse.unquote(href.rstrip('/').rsplit('/', 1)[-1]) or None
 
 
-def get_netnext_prs():
+def parse_lore_atom(chunks, regex, cls):
+    '''
+    Stream the Atom feed of a lore.kernel.org search and pick the subject, author and date of each entry.
+    Each entry is dropped as soon as it has been read, so only one entry is kept in memory at a time.
+    '''
+    import xml.etree.ElementTree
     res = []
-    uri = 'https://lore.kernel.org/netdev/?q=s%3B%22%5BGIT+PULL%5D+Networking+for+*%22'
-    with urllib.request.urlopen(uri) as response:
-        html = response.read()
-        parsed_html = bs4.BeautifulSoup(html, 'html.parser')
-        for item in parsed_html.find_all('a'):
-            if re_pull_rc1.search(item.text) and 'Re:' not in item.text:
-                res.append(NetNextPullRequest(item.text, item.parent.next_sibling))
+    entries = 0
+    parser = xml.etree.ElementTree.XMLPullParser(events=('end',))
+    for chunk in chunks:
+        with metrics.stage('parse'):
+            parser.feed(chunk)
+            for event, elem in parser.read_events():
+                if elem.tag != f'{atom_ns}entry':
+                    continue
+                entries += 1
+                subject = elem.findtext(f'{atom_ns}title', '').strip()
+                if regex.search(subject) and 'Re:' not in subject:
+                    author = elem.findtext(f'{atom_ns}author/{atom_ns}name', '').strip()
+                    when = parse_lore_date(elem.findtext(f'{atom_ns}updated'))
+                    link = elem.find(f'{atom_ns}link')
+                    msgid = message_id(link.get('href', '')) if link is not None else None
+                    res.append(cls.from_fields(subject, author, when, regex, msgid))
+                elem.clear()
+    parser.close()
+    return res, entries
+
+
+def parse_lore_html(html, regex, cls):
+    import bs4
+    res = []
+    entries = 0
+    parsed_html = bs4.BeautifulSoup(html, 'html.parser')
+    for item in parsed_html.find_all('a'):
+        if item.parent is None or not isinstance(item.parent.next_sibling, str):
+            continue
+        if not re_author.search(item.parent.next_sibling):
+            continue
+        entries += 1
+        if regex.search(item.text) and 'Re:' not in item.text:
+            res.append(cls(item.text, item.parent.next_sibling, regex, message_id(item.get('href', ''))))
+    return res, entries
+
+
+def parse_lore_page(chunks, regex, cls):
+    '''
+    Return the matching messages and the number of search results on the page.
+    A page that is not an Atom feed, like an error page served with 200, fails like the fetch itself.
+    '''
+    import xml.etree.ElementTree
+    if lore_format == 'atom':
+        try:
+            return parse_lore_atom(chunks, regex, cls)
+        except xml.etree.ElementTree.ParseError as err:
+            raise OSError(f'malformed lore.kernel.org feed: {err}') from err
+    html = b''.join(chunks)
+    with metrics.stage('parse'):
+        return parse_lore_html(html, regex, cls)
+
+
+def parse_netnext_history(data, regex=re_state):
+    res, entries = parse_lore_page([data], regex, NetNextStateChange)
+    return [state for state in res if state.date >= history_limit]
+
+
+def crawl_lore(query, regex, cls, limit=None, uri=None):
+    '''
+    Follow all the result pages of a lore.kernel.org search.  The pages are requested in windows of crawl_workers
+    offsets at a time, and the crawl stops at the first empty page or when the results are older than limit.
+    '''
+    res = []
+    offset = 0
+    executor = pool.executor()
+    while True:
+        offsets = [offset + idx * lore_page_size for idx in range(crawl_workers)]
+        pages = executor.map(lambda page: parse_lore_page(pool.chunks(lore_query_uri(query, offset=page, uri=uri)),
+                                                          regex, cls), offsets)
+        done = False
+        for items, entries in pages:
+            if done:
+                continue
+            res += items
+            if entries < lore_page_size or (limit and items and min(items).date < limit):
+                done = True
+        if done:
+            return res
+        offset = offsets[-1] + lore_page_size
+
+
+def get_netnext_history(tree=None):
+    tree = tree or NetNextTree()
+    return [state for state in crawl_lore(tree.query, tree.regex, NetNextStateChange, history_limit, tree.uri)
+            if state.date >= history_limit]
+
+
+def get_netnext_prs(tree=None):
+    '''Search the rc1 and rc2 pull requests on lore.kernel.org, or walk the whole public-inbox mirror of the tree'''
+    import netnext_git
+    if not tree or not tree.inbox:
+        return crawl_lore(pr_query, re_pull_rc1, NetNextPullRequest)
+    try:
+        with metrics.stage('inbox'):
+            return PublicInbox(tree.inbox).messages(re_pull_rc1, NetNextPullRequest)
+    except (netnext_git.GitError, ValueError) as err:
+        raise OSError(f'cannot read the public-inbox {tree.inbox}: {err}') from err
+
+
+class PublicInbox:
+    '''
+    Read the messages of a local public-inbox mirror of the list instead of the lore.kernel.org search.
+    The inbox is a v2 inbox with its git/<N>.git epochs or a single git repository.  The subject of a message is
+    its commit message and the date its author date, so only the commits are inflated, and the message blob only
+    for the matching subjects to get their Message-ID and their plain text body, kept in bodies.  The cursor keeps
+    the last processed commit per epoch, so a refresh only walks the commits added since.
+    '''
+    def __init__(self, path, cursorpath=None):
+        self.path = path
+        self.cursorpath = cursorpath
+        self.cursor = {}
+        self.bodies = {}
+        if cursorpath and os.path.exists(cursorpath):
+            self.cursor = load_datastore(cursorpath) or {}
+
+    def epochs(self):
+        '''Return the epoch names and git folders, the newest last'''
+        gitdir = os.path.join(self.path, 'git')
+        if not os.path.isdir(gitdir):
+            return [('.', self.path)]
+        names = [name for name in os.listdir(gitdir) if name.endswith('.git') and name[:-4].isdigit()]
+        return [(name, os.path.join(gitdir, name)) for name in sorted(names, key=lambda name: int(name[:-4]))]
+
+    @staticmethod
+    def message(repository, blob):
+        '''The Message-ID or None and the plain text body of a message blob'''
+        import email.parser
+        import email.policy
+        if blob is None:
+            return None, ''
+        message = email.parser.BytesParser(policy=email.policy.default).parsebytes(repository.read(blob)[1])
+        msgid = message['Message-ID']
+        body = message.get_body(preferencelist=('plain',))
+        return str(msgid).strip().strip('<>') if msgid else None, body.get_content() if body else ''
+
+    def messages(self, regex, cls, limit=history_limit):
+        '''
+        Walk the commits of each epoch from its head back to the cursor, or to the first commit older than limit,
+        and return the matching messages.  The cursor moves to the heads, and is only written by save.
+        '''
+        import netnext_git
+        res = []
+        for name, gitdir in self.epochs():
+            with netnext_git.Repository(gitdir) as repository:
+                head = repository.ref('refs/heads/master') or repository.ref()
+                for sha, commit in repository.walk(head, self.cursor.get(name)):
+                    metrics.add('inbox_commits')
+                    if limit and commit.committed.date() < limit:
+                        break
+                    subject = netnext_git.subject(commit.message)
+                    if not regex.search(subject) or 'Re:' in subject:
+                        continue
+                    # A v2 epoch keeps the message in the m file, and a commit without it removes a message
+                    blob = repository.tree(commit.tree).get('m')
+                    if blob is None and name != '.':
+                        continue
+                    when = commit.authored.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+                    msgid, body = self.message(repository, blob)
+                    res.append(cls.from_fields(subject, commit.author, when, regex, msgid))
+                    if msgid:
+                        self.bodies[msgid] = body
+            if head:
+                self.cursor[name] = head
+        return res
+
+    def save(self):
+        import yaml
+        os.makedirs(os.path.dirname(self.cursorpath) or '.', exist_ok=True)
+        write_atomic(self.cursorpath, yaml.dump(self.cursor))
+
+
+def get_inbox_history(datastorepath, tree=None):
+    '''
+    Read the new messages of the public-inbox mirror of the tree and merge them into the history saved in
+    datastorepath.  The history and then the cursor are saved when they changed, the store is rewritten when a
+    message is older than the last stored event.  The bodies of the announcements go to the body cache next to
+    it, and the whole inbox is walked again when the body cache is missing.
+    Returns the history and a flag telling if it changed.
+    '''
+    import netnext_git
+    tree = tree or NetNextTree()
+    stored = load_history(datastorepath)
+    inbox = PublicInbox(tree.inbox, get_datastore_path(os.path.dirname(datastorepath), 'inboxcursor.yaml'))
+    bodypath = get_datastore_path(os.path.dirname(datastorepath), 'bodies.sqlite')
+    if not stored or not os.path.exists(bodypath):
+        inbox.cursor = {}
+    cursor = dict(inbox.cursor)
+    try:
+        with metrics.stage('inbox'):
+            news = inbox.messages(tree.regex, NetNextStateChange)
+    except (netnext_git.GitError, ValueError) as err:
+        raise OSError(f'cannot read the public-inbox {tree.inbox}: {err}') from err
+    walked = news
+    if not stored:
+        history = tree.corrections.apply(news)
+    else:
+        known = set([item.date for item in stored])
+        news = [item for item in tree.corrections.remove_excess(news) if item.date not in known]
+        history = sorted(stored + news)
+    # The store does not keep the Message-IDs, so the walked messages are matched by date
+    days = set([item.date for item in history])
+    with BodyCache(bodypath) as cache:
+        for item in walked:
+            if item.date in days and item.msgid in inbox.bodies:
+                cache.add(item.msgid, item.date, inbox.bodies[item.msgid])
+    changed = len(history) != len(stored)
+    if changed:
+        backfill = bool(stored) and min(item.date for item in news) <= stored[-1].date
+        save_datastore(datastorepath, history, replace=backfill)
+    if inbox.cursor != cursor:
+        inbox.save()
+    return history, changed
+
+
+def fetch_history(datastorepath=None, stalepath=None, tree=None):
+    '''
+    Fetch the history, incrementally from the history saved in datastorepath when given.
+    When lore.kernel.org fails or does not answer before the deadline, the history saved in stalepath is
+    served instead, and the next run tries again.
+    A tree with an inbox always reads its public-inbox mirror incrementally and saves the history in datastorepath,
+    or in stalepath without it.
+    Returns the history, a flag telling if the history changed and the fetch status.
+    '''
+    import http.client
+    try:
+        if tree and tree.inbox:
+            history, changed = get_inbox_history(datastorepath or stalepath or get_datastore_path(tree.outdir), tree)
+        elif datastorepath:
+            history, changed = get_cached_history(datastorepath, tree)
+        else:
+            history, changed = get_updated_history(tree), True
+        return history, changed, {'status': 'updated' if changed else 'unchanged', 'error': None}
+    except (OSError, http.client.HTTPException) as err:
+        stale = load_history(stalepath or datastorepath) if stalepath or datastorepath else []
+        if not stale:
+            raise
+        return stale, False, stale_status(err)
+
+
+def stale_status(err):
+    print(f'lore.kernel.org failed: {err}: using the saved status')
+    metrics.add('stale_fetches')
+    return {'status': 'stale', 'error': str(err) or err.__class__.__name__}
+
+
+def fetch_all(pullreq=False, repo=None, datastorepath=None, indexpath=None, stalepath=None, tree=None):
+    '''
+    Run the lore.kernel.org queries and the git tag listing concurrently.
+    With a datastorepath the history is fetched incrementally from the saved history, and with an indexpath the
+    linux tags come from the tag index.  With a stalepath the history saved there is used when lore fails.
+    A tree with an inbox reads the history and the pull requests from it.
+    Returns the history, a flag telling if the history changed, the pull requests, the linux tags and the fetch
+    status.
+    '''
+    import concurrent.futures
+    with metrics.stage('fetch'), concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+        history = executor.submit(fetch_history, datastorepath, stalepath, tree)
+        prs = executor.submit(get_netnext_prs, tree) if pullreq else None
+        tags = executor.submit(get_git_linux_tags, repo, indexpath) if repo else None
+        history, changed, status = history.result()
+        return history, changed, prs.result() if prs else [], tags.result() if tags else None, status
+
+
+def fetch_trees(trees, repo=None, indexpath=None, cached=False):
+    '''
+    Fetch the history of all the trees and the git tags concurrently over the shared connection pool.
+    With cached each tree starts from the history saved in its outdir, and saves it again when it changed.
+    A tree that cannot be fetched gets the history saved in its outdir.
+    Returns a list of (tree, history, fetch status) and the linux tags.
+    '''
+    import concurrent.futures
+
+    def fetch(tree):
+        datastorepath = get_datastore_path(tree.outdir)
+        history, changed, status = fetch_history(datastorepath if cached else None, datastorepath, tree)
+        if cached and changed:
+            save_datastore(datastorepath, history)
+        return tree, history, status
+
+    with metrics.stage('fetch'), concurrent.futures.ThreadPoolExecutor(max_workers=len(trees) + 1) as executor:
+        tags = executor.submit(get_git_linux_tags, repo, indexpath) if repo else None
+        histories = list(executor.map(fetch, trees))
+        return histories, tags.result() if tags else None
+
+
+month_names = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+re_announced_date = (r'(?P<date>(?P<iso>\d{4}-\d{2}-\d{2})'
+                     rf'|(?P<month>{"|".join(month_names)})[a-z]*\.?\s+(?P<day>\d{{1,2}})(?:st|nd|rd|th)?\b'
+                     r'(?:,?\s+(?P<year>\d{4}))?'
+                     rf'|(?P<day2>\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?(?P<month2>{"|".join(month_names)})[a-z]*\.?'
+                     r'(?:,?\s+(?P<year2>\d{4}))?)')
+# The rules are tried in order and a date is only taken by the first rule that matches it, so "closed until
+# Dec 5th" is an opening on Dec 5th and not a closing.  Each rule has the announced state and a day offset.
+announce_patterns = [
+    (r'\bclosed?\b[^.]{0,60}?\b(?:until|till)\s+(?:\w+,?\s+)?', 'Open', 0),
+    (r'\bclosed?\b[^.]{0,60}?\b(?:through|thru)\s+(?:\w+,?\s+)?', 'Open', 1),
+    (r'\bre-?open(?:s|ed|ing)?\b[^.]{0,60}?', 'Open', 0),
+    (r'\bclos(?:e|es|ed|ing)\b[^.]{0,60}?', 'Closed', 0),
+]
+
+
+@functools.lru_cache(maxsize=None)
+def announce_rules():
+    '''Compile the rules on first use, they are not needed to show the cycles'''
+    return [(re.compile(prefix + re_announced_date, re.IGNORECASE), state, offset)
+            for prefix, state, offset in announce_patterns]
+
+
+def announcement_text(body):
+    '''The text of a message body without the quoted lines and the signature'''
+    lines = []
+    for line in body.splitlines():
+        if line.rstrip() == '--':
+            break
+        if not line.lstrip().startswith('>'):
+            lines.append(line)
+    return '\n'.join(lines)
+
+
+def announced_date(match, sent):
+    '''The date of a rule match.  Without a year it is the date nearest to the day the message was sent'''
+    if match.group('iso'):
+        return datetime.date.fromisoformat(match.group('iso'))
+    month = month_names.index((match.group('month') or match.group('month2'))[:3].lower()) + 1
+    day = int(match.group('day') or match.group('day2'))
+    year = match.group('year') or match.group('year2')
+    if year:
+        return datetime.date(int(year), month, day)
+    candidates = []
+    for year in (sent.year - 1, sent.year, sent.year + 1):
+        try:
+            candidates.append(datetime.date(year, month, day))
+        except ValueError:
+            # Feb 29th only exists in the leap years
+            pass
+    return min(candidates, key=lambda candidate: abs(candidate - sent))
+
+
+def announced_dates(body, sent):
+    '''Return the {date: state} changes that a message body announces for the days after it was sent'''
+    text = announcement_text(body)
+    taken = set()
+    res = {}
+    for regex, state, offset in announce_rules():
+        for match in regex.finditer(text):
+            if match.start('date') in taken:
+                continue
+            taken.add(match.start('date'))
+            try:
+                day = announced_date(match, sent) + datetime.timedelta(days=offset)
+            except ValueError:
+                continue
+            if day > sent:
+                res[day] = state
     return res
 
 
+class BodyCache:
+    '''
+    Keep the plain text bodies of the announcements in an SQLite database indexed by Message-ID, so each body is
+    downloaded once.  A message without a plain text body is kept with an empty body.
+    '''
+    def __init__(self, filename):
+        import sqlite3
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.execute('CREATE TABLE IF NOT EXISTS bodies '
+                        '(msgid TEXT PRIMARY KEY, date TEXT NOT NULL, body TEXT NOT NULL) WITHOUT ROWID')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def __contains__(self, msgid):
+        return self.db.execute('SELECT 1 FROM bodies WHERE msgid = ?', (msgid,)).fetchone() is not None
+
+    def add(self, msgid, date, body):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO bodies VALUES (?, ?, ?)', (msgid, str(date), body))
+
+    def bodies(self):
+        '''Return the date and the body of the cached messages, oldest first'''
+        return [(datetime.date.fromisoformat(day), body)
+                for day, body in self.db.execute('SELECT date, body FROM bodies ORDER BY date')]
+
+    def announcements(self):
+        '''Return the announced {date: state} changes of all the cached bodies, the latest announcement wins'''
+        res = {}
+        for sent, body in self.bodies():
+            res.update(announced_dates(body, sent))
+        return res
+
+
+def message_uri(msgid, uri=None):
+    return f'{uri or lore_uri}{urllib.parse.quote(msgid, safe="@+")}/raw'
+
+
+def fetch_message_body(uri):
+    '''Stream a raw message, inflated while it arrives when it is gzip encoded, and return its plain text body'''
+    import email.parser
+    import email.policy
+    parser = email.parser.BytesFeedParser(policy=email.policy.default)
+    for chunk in pool.inflated_chunks(uri):
+        parser.feed(chunk)
+    body = parser.close().get_body(preferencelist=('plain',))
+    return body.get_content() if body else ''
+
+
+def fetch_bodies(history, cache, uri=None):
+    '''
+    Download the bodies of the announcements in the history that are not in the cache yet, crawl_workers at a time.
+    A message that cannot be downloaded is skipped and tried again on the next run.  Returns the number of new bodies.
+    '''
+    import http.client
+    known = [item for item in history if item.msgid]
+    missing = [item for item in known if item.msgid not in cache]
+    metrics.add('cache_hits', len(known) - len(missing), cache='bodies')
+    metrics.add('cache_misses', len(missing), cache='bodies')
+
+    def fetch(item):
+        try:
+            return item, fetch_message_body(message_uri(item.msgid, uri))
+        except (OSError, http.client.HTTPException) as err:
+            print(f'could not fetch the body of {item.msgid}: {err}')
+            return item, None
+
+    added = 0
+    with metrics.stage('bodies'):
+        for item, body in pool.executor().map(fetch, missing):
+            if body is not None:
+                cache.add(item.msgid, item.date, body)
+                added += 1
+    return added
+
+
+def get_announcements(history, bodypath, tree=None, fetch=True):
+    '''
+    Return the open and close dates announced in the bodies of the announcements as {date: state}.
+    With fetch the bodies of the new announcements are downloaded first, otherwise only the cached ones are read.
+    A tree with an inbox never downloads them: they are cached when its inbox is read.
+    '''
+    tree = tree or NetNextTree()
+    with BodyCache(bodypath) as cache:
+        if fetch and not tree.inbox:
+            fetch_bodies(history, cache, tree.uri)
+        return cache.announcements()
+
+
+class CycleBuilder:
+    '''
+    Build the cycles with a state machine that takes one event at a time.
+    Repeated Open or Closed events are skipped, and an opening that is closed again within min_open days is an
+    interim opening that is folded into the closed period of the previous cycle.
+    '''
+    def __init__(self, min_open=20):
+        self.min_open = min_open
+        self.day1 = None
+        self.day2 = None
+        # The last cycle ended with an opening that can still turn out to be an interim opening
+        self.pending = None
+        self.cycles = []
+
+    @property
+    def completed(self):
+        return self.cycles + [self.pending] if self.pending else self.cycles
+
+    def add(self, event):
+        '''Return the cycles that the event completes'''
+        done = []
+        if event.state == 'Open':
+            if self.day1 is None:
+                self.day1 = event.date
+            elif self.day2 is not None:
+                self.pending = NetNextCycle(self.day1, self.day2, event.date)
+                self.day1 = event.date
+                self.day2 = None
+        elif self.day1 is not None and self.day2 is None:
+            if self.pending and (event.date - self.day1).days < self.min_open:
+                self.day1 = self.pending.day1
+                self.day2 = self.pending.day2
+            else:
+                if self.pending:
+                    done.append(self.pending)
+                self.day2 = event.date
+            self.pending = None
+        self.cycles += done
+        return done
+
+    def finish(self):
+        done = [self.pending] if self.pending else []
+        self.cycles += done
+        self.pending = None
+        return done
+
+
+def iter_netnext_cycles(history, min_open=20):
+    builder = CycleBuilder(min_open)
+    for item in history:
+        yield from builder.add(item)
+    yield from builder.finish()
+
+
 def generate_netnext_cycles(history):
-    cycles = []
-    size = len(history)
-    for idx, item in enumerate(history):
-        if item.state == 'Open':
-            if idx < size - 2:
-                cycles.append(NetNextCycle(item.date, history[idx + 1].date, history[idx + 2].date))
-    for idx, cycle in enumerate(cycles):
-        if cycle.open.days < 20:
-            del cycles[idx]
+    return list(iter_netnext_cycles(history))
+
+
+def cycle_durations(cycles):
+    open_days = [cycle.open.days for cycle in cycles if not cycle.predicted]
+    closed_days = [cycle.closed.days for cycle in cycles if not cycle.predicted]
+    return open_days, closed_days
+
+
+def model_average(open_days, closed_days):
+    open_days = open_days[-3:]
+    closed_days = closed_days[-3:]
+    return int(sum(open_days) / len(open_days)), int(sum(closed_days) / len(closed_days))
+
+
+def model_median(open_days, closed_days):
+    import numpy
+    return int(numpy.median(open_days)), int(numpy.median(closed_days))
+
+
+def model_weighted(open_days, closed_days, halflife=3):
+    import numpy
+    # The weight of a cycle is halved for every halflife cycles back in history
+    weights = 0.5 ** (numpy.arange(len(open_days))[::-1] / halflife)
+    return (int(round(numpy.average(open_days, weights=weights))),
+            int(round(numpy.average(closed_days, weights=weights))))
+
+
+prediction_models = {
+    'average': model_average,
+    'median': model_median,
+    'weighted': model_weighted,
+}
+
+
+class MonteCarloPrediction:
+    '''
+    Simulate the coming cycles by drawing (open, closed) duration pairs from all the historic cycles.
+    The current cycle only draws durations that are longer than what has already passed, and the announced state
+    changes are pinned in every simulated future.
+    All the samples are drawn and accumulated as arrays, so 100k simulated futures take a few milliseconds.
+    '''
+    quantiles = (5, 50, 95)
+
+    def __init__(self, cycles, history, today, samples=100000, future=2, seed=None, constraints=None):
+        import numpy
+        rng = numpy.random.default_rng(seed)
+        open_days, closed_days = cycle_durations(cycles)
+        opens = numpy.array(open_days)
+        closeds = numpy.array(closed_days)
+        self.today = today
+        if history[-1].state == 'Open':
+            self.start = history[-1].date
+            elapsed = (today - self.start).days
+            idx = self.draw(rng, samples, opens, elapsed)
+            if idx is None:
+                first = (numpy.full(samples, elapsed + 1), closeds[rng.integers(len(closeds), size=samples)])
+            else:
+                first = (opens[idx], closeds[idx])
+            self.current = True
+        elif len(history) > 1 and history[-2].state == 'Open':
+            self.start = history[-2].date
+            elapsed = (today - history[-1].date).days
+            idx = self.draw(rng, samples, closeds, elapsed)
+            first = (numpy.full(samples, (history[-1].date - self.start).days),
+                     numpy.full(samples, elapsed + 1) if idx is None else closeds[idx])
+            self.current = True
+        else:
+            self.start = cycles[-1].day3
+            idx = rng.integers(len(opens), size=samples)
+            first = (opens[idx], closeds[idx])
+            self.current = False
+        idx = rng.integers(len(opens), size=(samples, future))
+        lengths = numpy.empty((samples, 2 * (future + 1)), dtype=numpy.int64)
+        lengths[:, 0], lengths[:, 1] = first
+        lengths[:, 2::2] = opens[idx]
+        lengths[:, 3::2] = closeds[idx]
+        # Day offsets from the start of the first cycle: open, close, open, close, ...
+        self.boundaries = numpy.concatenate([numpy.zeros((samples, 1), dtype=numpy.int64),
+                                             numpy.cumsum(lengths, axis=1)], axis=1)
+        for day, state in sorted((constraints or {}).items()):
+            self.pin((day - self.start).days, state)
+        # The offsets are small integers, so a cumulative histogram per boundary gives both the quantiles and
+        # the open probabilities without sorting the samples
+        size = int(self.boundaries[:, -1].max()) + 1
+        self.cdf = numpy.array([numpy.cumsum(numpy.bincount(column, minlength=size)) / samples
+                                for column in self.boundaries.T])
+
+    @staticmethod
+    def draw(rng, samples, values, elapsed):
+        '''Draw the indexes of durations that are longer than the elapsed days'''
+        import numpy
+        eligible = numpy.flatnonzero(values > elapsed)
+        if eligible.size:
+            return eligible[rng.integers(eligible.size, size=samples)]
+        return None
+
+    def pin(self, offset, state):
+        '''
+        Move the coming opening or closing nearest to the announced day offset to it in every simulated future.
+        The following state changes move with it, and the ones before it are kept before it.
+        '''
+        import numpy
+        first = 1 if state == 'Closed' else 2
+        medians = numpy.median(self.boundaries[:, first::2], axis=0)
+        medians[medians < (self.today - self.start).days] = numpy.inf
+        if numpy.isinf(medians).all():
+            return
+        column = first + 2 * int(numpy.argmin(numpy.abs(medians - offset)))
+        self.boundaries[:, column:] += (offset - self.boundaries[:, column])[:, None]
+        latest = offset - numpy.arange(column - 1, 0, -1)
+        self.boundaries[:, 1:column] = numpy.minimum(self.boundaries[:, 1:column], latest)
+
+    def open_probability(self):
+        '''Return the probability of net-next being open for each day covered by all the simulated futures'''
+        horizon = int(self.boundaries[:, -1].min())
+        probability = (self.cdf[0:-1:2] - self.cdf[1::2]).sum(axis=0)
+        first = max((self.today - self.start).days, 0)
+        return [(self.start + datetime.timedelta(days=offset), float(probability[offset]))
+                for offset in range(first, horizon)]
+
+    def cycles(self):
+        import numpy
+        days = [[self.start + datetime.timedelta(days=int(numpy.searchsorted(cdf, quantile / 100))) for cdf in self.cdf]
+                for quantile in self.quantiles]
+        low, median, high = days
+        probabilities = dict(self.open_probability())
+        res = []
+        for idx in range(0, len(median) - 1, 2):
+            day1, day2, day3 = median[idx:idx + 3]
+            cycle = PredictedNetNextCycle(day1, (day2 - day1).days, (day3 - day2).days)
+            cycle.day2_range = (low[idx + 1], high[idx + 1])
+            cycle.day3_range = (low[idx + 2], high[idx + 2])
+            cycle.probabilities = dict([(day, prob) for day, prob in probabilities.items() if day1 <= day < day3])
+            res.append(cycle)
+        return res
+
+
+def pending_constraints(history, today, constraints):
+    '''The announced state changes that have not happened yet: after the last event and not before today'''
+    if not constraints or not history:
+        return {}
+    return dict([(day, state) for day, state in constraints.items() if day > history[-1].date and day >= today])
+
+
+def constrain_cycles(cycles, constraints):
+    '''
+    Pin the predicted closing or opening nearest to each announced date to it, and move the following predicted
+    cycles by as much so their durations are kept.
+    '''
+    for day, state in sorted(constraints.items()):
+        field = 'day2' if state == 'Closed' else 'day3'
+        candidates = [cycle for cycle in cycles if cycle.predicted and cycle.day1 < day
+                      and (state == 'Closed' or cycle.day2 < day)]
+        if not candidates:
+            continue
+        cycle = min(candidates, key=lambda cycle: abs(getattr(cycle, field) - day))
+        shift = day - getattr(cycle, field)
+        if state == 'Closed':
+            cycle.day2 += shift
+        cycle.day3 += shift
+        for following in cycles[cycles.index(cycle) + 1:]:
+            following.day1 += shift
+            following.day2 += shift
+            following.day3 += shift
     return cycles
 
 
-def predict(cycles, history, today):
-    open_days = []
-    closed_days = []
-    for cycle in cycles[-3:]:
-        open_days.append(cycle.open.days)
-        closed_days.append(cycle.closed.days)
-    next_open = int(sum(open_days) / len(open_days))
-    next_closed = int(sum(closed_days) / len(closed_days))
+def predict(cycles, history, today, model='average', samples=100000, constraints=None):
+    '''
+    Append the predicted cycles to the historic cycles.  The constraints are the announced state changes as
+    {date: state}: the ones still to come are hard constraints on the prediction.
+    '''
+    constraints = pending_constraints(history, today, constraints)
+    if model == 'montecarlo':
+        return cycles + MonteCarloPrediction(cycles, history, today, samples, constraints=constraints).cycles()
+    next_open, next_closed = prediction_models[model](*cycle_durations(cycles))
     size = len(history)
     for idx, item in enumerate(history):
         if item.state == 'Open':
@@ -261,61 +1565,838 @@ def predict(cycles, history, today):
     for idx in range(0, 2):
         open_date = cycles[-1].day3
         cycles.append(PredictedNetNextCycle(open_date, next_open, next_closed))
-    return cycles
+    return constrain_cycles(cycles, constraints)
+
+
+def conditional_median(values, elapsed):
+    '''Median of the values larger than each elapsed day count, which is what the montecarlo model converges to'''
+    import numpy
+    values = numpy.sort(values)
+    first = numpy.searchsorted(values, elapsed, side='right')
+    idx = numpy.minimum(first + (len(values) - first) // 2, len(values) - 1)
+    return numpy.where(first < len(values), values[idx], elapsed + 1)
+
+
+def backtest(history, models=None, start=history_limit):
+    '''
+    Replay every day from start and predict the next state change with only the events known on that day.
+    The cycles are built incrementally, and as a model only changes its prediction when an event arrives, all the
+    days between two events are evaluated in one batch.  Returns a report with the error in days per model.
+    '''
+    import numpy
+    models = models or list(prediction_models) + ['montecarlo']
+    errors = dict([(model, []) for model in models])
+    transitions = dict([(model, []) for model in models])
+    builder = CycleBuilder()
+    events = sorted(history)
+    for event, following in zip(events, events[1:]):
+        builder.add(event)
+        if not builder.completed or following.state == event.state:
+            continue
+        first = max(event.date, start)
+        if first >= following.date:
+            continue
+        days = numpy.arange(first.toordinal(), following.date.toordinal())
+        elapsed = days - event.date.toordinal()
+        open_days, closed_days = cycle_durations(builder.completed)
+        column = 0 if event.state == 'Open' else 1
+        for model in models:
+            if model == 'montecarlo':
+                length = conditional_median(numpy.array([open_days, closed_days][column]), elapsed)
+            else:
+                length = prediction_models[model](open_days, closed_days)[column]
+            # The prediction is moved forward while the state change has not happened yet
+            predicted = numpy.maximum(event.date.toordinal() + length, days + 1)
+            error = predicted - following.date.toordinal()
+            errors[model].append(error)
+            transitions[model].append({
+                'date': str(following.date),
+                'state': following.state,
+                'days': len(days),
+                'mae': float(numpy.abs(error).mean()),
+                'first_error': int(error[0]),
+            })
+    report = {'start': str(start), 'end': str(events[-1].date), 'models': {}}
+    for model in models:
+        error = numpy.concatenate(errors[model]) if errors[model] else numpy.zeros(0, dtype=numpy.int64)
+        absolute = numpy.abs(error)
+        report['models'][model] = {
+            'days': int(error.size),
+            'mae': float(absolute.mean()) if error.size else None,
+            'rmse': float(numpy.sqrt((error ** 2).mean())) if error.size else None,
+            'bias': float(error.mean()) if error.size else None,
+            'median_abs': float(numpy.median(absolute)) if error.size else None,
+            'within_7': float((absolute <= 7).mean()) if error.size else None,
+            'transitions': transitions[model],
+        }
+    return report
+
+
+def save_report(filename, report):
+    import json
+    with open(filename, 'wt') as fobj:
+        json.dump(report, fobj, indent=2)
+    print(f"... wrote {filename}")
 
 
-def get_git_linux_tags(repo):
-    cp = subprocess.run(['git', '-C', repo, 'tag', '-l',
-                         '--format=%(refname:short);%(taggerdate:iso-strict);%(contents:subject)',
-                         '--sort=taggerdate'],
-                        capture_output=True)
+def parse_linux_tag(line):
+    mt = re_rc1_tag.findall(line)
+    if mt:
+        tagstr, datestr, versionstr = mt[0][0:3]
+        return LinuxTag(datetime.datetime.fromisoformat(datestr), tagstr, versionstr)
+    return None
+
+
+class LinuxTagIndex:
+    '''
+    Keep the rc1 tag lines of a Linux repo in a file next to the datastore.
+    The index is keyed on the state of packed-refs and refs/tags, so an unchanged repo costs a few stat calls,
+    and when the refs change only the new tag objects are read, with netnext_git or else with git.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.key = None
+        self.lines = {}
+        self.runs = 0
+        if os.path.exists(filename):
+            data = load_datastore(filename) or {}
+            self.key = data.get('key')
+            self.lines = data.get('lines', {})
+
+    @staticmethod
+    def refs_key(repo):
+        import netnext_git
+        gitdir = netnext_git.git_dir(repo)
+        key = []
+        for name in ['packed-refs', os.path.join('refs', 'tags')]:
+            try:
+                st = os.stat(os.path.join(gitdir, name))
+                key += [st.st_mtime_ns, st.st_size]
+            except FileNotFoundError:
+                key += [0, 0]
+        return key
+
+    def git(self, repo, *args):
+        import subprocess
+        self.runs += 1
+        with metrics.stage('git'):
+            cp = subprocess.run(['git', '-C', repo] + list(args), capture_output=True)
+        if cp.returncode != 0:
+            return None
+        print(f'run: {" ".join(cp.args[:5])}')
+        return [line for line in cp.stdout.decode().split('\n') if line]
+
+    def update(self, repo):
+        '''Bring the index up to date with the repo and tell if it changed'''
+        key = self.refs_key(repo)
+        if key == self.key:
+            metrics.add('cache_hits', cache='tags')
+            return False
+        metrics.add('cache_misses', cache='tags')
+        import netnext_git
+        try:
+            with metrics.stage('git'), netnext_git.Repository(repo) as repository:
+                refs = repository.refs()
+                names = set([name for name in refs if '-rc1' in name])
+                news = sorted(names - set(self.lines))
+                lines = [netnext_git.tag_line(repository, name, refs[name]) for name in news]
+        except (netnext_git.GitError, OSError, ValueError) as err:
+            print(f'git reader: {err}')
+            names = self.git(repo, 'for-each-ref', '--format=%(refname:short)', 'refs/tags')
+            if names is None:
+                return False
+            names = set([name for name in names if '-rc1' in name])
+            news = sorted(names - set(self.lines))
+            lines = []
+            if news:
+                lines = self.git(repo, 'for-each-ref', f'--format={tag_format}',
+                                 *[f'refs/tags/{name}' for name in news]) or []
+        self.lines = dict([(name, line) for name, line in self.lines.items() if name in names])
+        for line in lines:
+            if line:
+                self.lines[line.split(';', 1)[0]] = line
+        self.key = key
+        return True
+
+    def tags(self):
+        tags = [parse_linux_tag(line) for line in self.lines.values()]
+        return sorted([tag for tag in tags if tag], key=lambda tag: tag.date)
+
+    def save(self):
+        import yaml
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        write_atomic(self.filename, yaml.dump({'key': self.key, 'lines': self.lines}))
+
+
+def get_git_linux_tags(repo, indexpath=None):
+    if indexpath:
+        index = LinuxTagIndex(indexpath)
+        if index.update(repo):
+            index.save()
+        return index.tags()
+    import netnext_git
+    try:
+        with metrics.stage('git'):
+            lines = netnext_git.tag_lines(repo, lambda name: '-rc1' in name)
+        return [tag for tag in [parse_linux_tag(line) for line in lines] if tag]
+    except (netnext_git.GitError, OSError, ValueError) as err:
+        print(f'git reader: {err}')
+    import subprocess
+    with metrics.stage('git'):
+        cp = subprocess.run(['git', '-C', repo, 'tag', '-l',
+                             f'--format={tag_format}',
+                             '--sort=taggerdate'],
+                            capture_output=True)
     if cp.returncode == 0:
         print(f'run: {" ".join(cp.args)}')
         lines = cp.stdout.decode().split('\n')
         history = []
-        # Look for the RC1 tags as they start a new Linux Version
-        regex = re.compile(r'([^;]+)-rc1-.*;([^;]+);([^;]+)-rc1')
         for line in lines:
-            mt = regex.findall(line)
-            if mt:
-                tagstr, datestr, versionstr = mt[0][0:3]
-                history.append(LinuxTag(datetime.datetime.fromisoformat(datestr), tagstr, versionstr))
+            tag = parse_linux_tag(line)
+            if tag:
+                history.append(tag)
         return history
     return None
 
 
+def build_cycles(history, today, linux_versions=None, count=17, model='average', constraints=None):
+    with metrics.stage('cycles'):
+        cycles = generate_netnext_cycles(history)
+    with metrics.stage('predict'):
+        cycles = predict(cycles, history, today, model, constraints=constraints)
+    metrics.set('events', len(history))
+    metrics.set('cycles', len(cycles))
+    historic = [cycle for cycle in cycles if not cycle.predicted]
+    cycles = historic[-count:] + cycles[len(historic):]
+    if linux_versions:
+        add_linux_versions(cycles, linux_versions)
+    return cycles
+
+
+class LinuxVersionResolver:
+    '''
+    Map the end of a cycle to the first rc1 tag from 13 days before to 1 day after it, using a bisect over the
+    sorted tag dates.  Cycles without a tag get the version following the previous cycle.
+    '''
+    before = datetime.timedelta(days=13)
+    after = datetime.timedelta(days=1)
+
+    def __init__(self, linux_versions):
+        self.tags = sorted(linux_versions, key=lambda tag: tag.date)
+        self.dates = [tag.date for tag in self.tags]
+
+    def find(self, day):
+        idx = bisect.bisect_left(self.dates, day - self.before)
+        if idx < len(self.dates) and self.dates[idx] <= day + self.after:
+            return self.tags[idx]
+        return None
+
+    def resolve(self, cycles):
+        versions = []
+        last = self.tags[0].version
+        for cycle in cycles:
+            tag = self.find(cycle.day3)
+            last = tag.version if tag else LinuxTag.next_version(last)
+            versions.append(last)
+        return versions
+
+
 def add_linux_versions(cycles, linux_versions):
-    last_tag = linux_versions[0]
+    for cycle, version in zip(cycles, LinuxVersionResolver(linux_versions).resolve(cycles)):
+        cycle.set_version(version)
+
+
+class CycleIndex:
+    '''
+    Answer "is net-next open on this day" and "how many open days are there in this range" over the historic and
+    predicted cycles with a bisect over the sorted period starts and prefix sums of the open days, so each query
+    is O(log n).  Days in a predicted cycle with montecarlo probabilities also get the probability of the answer.
+    A later cycle that starts inside an earlier one replaces the rest of it, and days between cycles are unknown.
+    '''
+    def __init__(self, cycles):
+        self.starts = []
+        self.states = []
+        self.cycles = []
+        self.end = None
+        probabilities = {}
+        for cycle in sorted(cycles, key=lambda cycle: cycle.day1):
+            for start, end, state in [(cycle.day1, cycle.day2, True), (cycle.day2, cycle.day3, False)]:
+                if start >= end:
+                    continue
+                while self.starts and start <= self.starts[-1]:
+                    self.starts.pop()
+                    self.states.pop()
+                    self.cycles.pop()
+                if self.end and start > self.end:
+                    self.add(self.end, None, None)
+                self.add(start, state, cycle)
+                self.end = end
+            if cycle.predicted and cycle.probabilities:
+                probabilities.update(cycle.probabilities)
+        # Open and known days before the start of each period
+        self.open_before = [0]
+        self.known_before = [0]
+        for idx in range(len(self.starts) - 1):
+            days = (self.starts[idx + 1] - self.starts[idx]).days
+            self.open_before.append(self.open_before[-1] + (days if self.states[idx] else 0))
+            self.known_before.append(self.known_before[-1] + (days if self.states[idx] is not None else 0))
+        # The montecarlo probabilities cover consecutive days, so their sums are prefix sums too
+        self.probability_days = sorted(probabilities)
+        self.probability_sums = [0.0]
+        for day in self.probability_days:
+            self.probability_sums.append(self.probability_sums[-1] + probabilities[day])
+        self.probabilities = probabilities
+
+    def add(self, start, state, cycle):
+        self.starts.append(start)
+        self.states.append(state)
+        self.cycles.append(cycle)
+
+    def find(self, day):
+        '''Return the index of the period holding day or None'''
+        idx = bisect.bisect_right(self.starts, day) - 1
+        if idx < 0 or day >= self.end:
+            return None
+        return idx
+
+    def before(self, day):
+        '''Return the number of open and known days before day'''
+        idx = bisect.bisect_right(self.starts, day) - 1
+        if idx < 0:
+            return 0, 0
+        inside = (min(day, self.end) - self.starts[idx]).days
+        state = self.states[idx]
+        return (self.open_before[idx] + (inside if state else 0),
+                self.known_before[idx] + (inside if state is not None else 0))
+
+    def state(self, day):
+        '''Answer a point query'''
+        idx = self.find(day)
+        answer = {'date': str(day), 'state': None, 'predicted': False, 'probability': None, 'cycle': None}
+        if idx is None or self.states[idx] is None:
+            return answer
+        cycle = self.cycles[idx]
+        answer.update({
+            'state': 'Open' if self.states[idx] else 'Closed',
+            'predicted': cycle.predicted,
+            'cycle': [str(cycle.day1), str(cycle.day2), str(cycle.day3)],
+        })
+        if day in self.probabilities:
+            probability = self.probabilities[day]
+            answer['probability'] = probability if self.states[idx] else 1 - probability
+        return answer
+
+    def range(self, first, last):
+        '''Answer a range query from first to last, both included'''
+        end = max(last + datetime.timedelta(days=1), first)
+        days = (end - first).days
+        open_end, known_end = self.before(end)
+        open_first, known_first = self.before(first)
+        open_days = open_end - open_first
+        known_days = known_end - known_first
+        answer = {
+            'from': str(first),
+            'to': str(last),
+            'days': days,
+            'open_days': open_days,
+            'closed_days': known_days - open_days,
+            'unknown_days': days - known_days,
+            'expected_open_days': None,
+        }
+        low = bisect.bisect_left(self.probability_days, first)
+        high = bisect.bisect_left(self.probability_days, end)
+        if high > low:
+            # Replace the open days of the days with a probability with their expected value
+            pfirst = self.probability_days[low]
+            pend = self.probability_days[high - 1] + datetime.timedelta(days=1)
+            predicted_open = self.before(pend)[0] - self.before(pfirst)[0]
+            answer['expected_open_days'] = (open_days - predicted_open +
+                                            self.probability_sums[high] - self.probability_sums[low])
+        return answer
+
+    def query(self, query):
+        '''
+        Answer a query that is a date, a "first..last" range or a dict with a "date" or with "from" and "to".
+        '''
+        if isinstance(query, str):
+            first, _, last = query.strip().partition('..')
+            query = {'from': first, 'to': last} if last else {'date': first}
+        if 'date' in query:
+            return self.state(datetime.date.fromisoformat(query['date']))
+        return self.range(datetime.date.fromisoformat(query['from']), datetime.date.fromisoformat(query['to']))
+
+
+def read_queries(fobj):
+    '''Read a JSON list of queries, or one JSON query or plain query per line'''
+    import json
+    text = fobj.read()
+    if text.lstrip().startswith('['):
+        return json.loads(text)
+    queries = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line:
+            queries.append(json.loads(line) if line.startswith(('{', '"')) else line)
+    return queries
+
+
+templatepath = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'templates')
+cachepath = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'netnextpredict')
+
+
+@functools.lru_cache(maxsize=None)
+def get_environment():
+    '''The template environment is created once, and the compiled templates are kept in a bytecode cache'''
+    import jinja2
+    if not os.path.exists(cachepath):
+        os.makedirs(cachepath)
+    return jinja2.Environment(loader=jinja2.FileSystemLoader(templatepath),
+                              bytecode_cache=jinja2.FileSystemBytecodeCache(cachepath))
+
+
+# Read once at import: reading the umask sets it, which would race with the files created by other threads
+umask = os.umask(0)
+os.umask(umask)
+
+
+def write_atomic(filename, data):
+    '''Write to a temporary file in the same folder and rename it, so readers never see a partial file'''
+    import tempfile
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=f'.{os.path.basename(filename)}.')
+    try:
+        # mkstemp creates the file with mode 0600: give it the mode a plain open would
+        os.fchmod(fd, 0o666 & ~umask)
+        with os.fdopen(fd, 'wb') as fobj:
+            fobj.write(data.encode('utf-8') if isinstance(data, str) else data)
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+
+
+sourcepath = os.path.abspath(os.path.dirname(__file__))
+asset_sources = ['css/bootstrap.min.css', 'images/background.jpg', 'images/favicon.png']
+re_hashed_asset = re.compile(r'\.[0-9a-f]{10}\.\w+$')
+
+
+def content_hash(data):
+    import hashlib
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def hashed_name(name, digest):
+    root, ext = os.path.splitext(name)
+    return f'{root}.{digest}{ext}'
+
+
+def precompress(filename):
+    '''Write gzip and, when the brotli module is available, brotli encoded copies next to the file'''
+    import gzip
+    with open(filename, 'rb') as fobj:
+        data = fobj.read()
+    write_atomic(f'{filename}.gz', gzip.compress(data, 9, mtime=0))
+    try:
+        import brotli
+    except ImportError:
+        remove_precompressed(filename, ['.br'])
+        return
+    write_atomic(f'{filename}.br', brotli.compress(data))
+
+
+def remove_precompressed(filename, extensions=('.gz', '.br')):
+    '''Remove the encoded copies of an earlier run, so the server never serves them for a newer file'''
+    for ext in extensions:
+        if os.path.exists(filename + ext):
+            os.unlink(filename + ext)
+
+
+def resize_background(data, width, quality=80):
+    '''Return the background as a JPEG and a WebP image no wider than width, or None without Pillow'''
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    import io
+    image = Image.open(io.BytesIO(data)).convert('RGB')
+    if image.width > width:
+        image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+    variants = {}
+    for ext, fmt in [('.jpg', 'JPEG'), ('.webp', 'WEBP')]:
+        output = io.BytesIO()
+        image.save(output, fmt, quality=quality, optimize=True, **({'progressive': True} if fmt == 'JPEG' else {}))
+        variants[ext] = output.getvalue()
+    return variants
+
+
+def build_assets(outputpath, background_width=1920):
+    '''
+    Copy the page assets to outputpath with their content hash in the file name, so they can be cached forever,
+    and precompress the text assets.  The background is also resized and converted to WebP when Pillow is
+    available.  Files that already exist are not written again.  Returns a map from asset name to hashed name.
+    '''
+    with metrics.stage('assets'):
+        outputpath = os.path.expanduser(outputpath)
+        assets = {}
+        for name in asset_sources:
+            with open(os.path.join(sourcepath, name), 'rb') as fobj:
+                data = fobj.read()
+            digest = content_hash(data)
+            variants = {name: data}
+            if name == 'images/background.jpg':
+                digest = content_hash(data + str(background_width).encode())
+                names = [hashed_name(name, digest), hashed_name('images/background.webp', digest)]
+                if all([os.path.exists(os.path.join(outputpath, item)) for item in names]):
+                    assets.update(zip([name, 'images/background.webp'], names))
+                    continue
+                resized = resize_background(data, background_width)
+                if resized:
+                    variants = {name: resized['.jpg'], 'images/background.webp': resized['.webp']}
+            for variant, content in variants.items():
+                assets[variant] = hashed_name(variant, digest)
+                filename = os.path.join(outputpath, assets[variant])
+                if os.path.exists(filename):
+                    continue
+                if not os.path.exists(os.path.dirname(filename)):
+                    os.makedirs(os.path.dirname(filename))
+                write_atomic(filename, content)
+                if variant.endswith('.css'):
+                    precompress(filename)
+                print(f"... wrote {filename}")
+        return assets
+
+
+def render_digest(template_name, cycles, now, linux_versions, assets=None, title='NetNext', status=None):
+    '''
+    Hash everything the page, cycles.json and the calendar are rendered from: the template, the cycles, the
+    versions, the assets, the fetch status and the day
+    '''
+    import hashlib
+    stat = os.stat(os.path.join(templatepath, template_name))
+    inputs = [template_name, stat.st_mtime_ns, stat.st_size, str(now.date()), bool(linux_versions),
+              sorted((assets or {}).items()), title, sorted((status or {}).items())]
     for cycle in cycles:
-        for tag in linux_versions:
-            diff = tag.date - cycle.day3
-            near = diff.days > -14 and diff.days < 2
-            if near:
-                cycle.set_version(tag.version)
-                last_tag = tag
-                break
-        if cycle.has_no_version():
-            last_tag.increment()
-            cycle.set_version(last_tag.version)
-
-
-def generate_html(cycles, now, linux_versions, outputpath):
-    html_filename = os.path.join(os.path.expanduser(outputpath), 'index.html')
-    templatepath = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'templates')
-    print('templates:', templatepath)
-    environment = jinja2.Environment(loader=jinja2.FileSystemLoader(templatepath))
-    html_template = environment.get_template('netnext.html.jinja')
-    content = {
-        'cycles': cycles,
-        'linux_versions': linux_versions,
-        'generated': now,
-    }
-    with open(html_filename, mode="w", encoding="utf-8") as results:
-        results.write(html_template.render(content))
-        print(f"... wrote {html_filename}")
+        inputs.append((cycle.day1, cycle.day2, cycle.day3, cycle.version, cycle.predicted,
+                       cycle.day2_range if cycle.predicted else None, cycle.day3_range if cycle.predicted else None))
+    return hashlib.sha256(repr(inputs).encode()).hexdigest()
+
+
+def export_cycles(cycles, now, status=None):
+    res = []
+    for cycle in cycles:
+        item = {
+            'open': str(cycle.day1),
+            'close': str(cycle.day2),
+            'reopen': str(cycle.day3),
+            'open_days': cycle.open.days,
+            'closed_days': cycle.closed.days,
+            'predicted': cycle.predicted,
+            'version': cycle.version,
+        }
+        if cycle.predicted and cycle.day2_range:
+            item['close_range'] = [str(day) for day in cycle.day2_range]
+            item['reopen_range'] = [str(day) for day in cycle.day3_range]
+        res.append(item)
+    return {'generated': now.isoformat(), 'fetch': status, 'cycles': res}
+
+
+def cycles_ics(cycles, now, name='net-next'):
+    '''Return an iCalendar with an all-day event for each open and closed period'''
+    stamp = now.astimezone(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    uid = name.replace('-', '')
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//netnextpredict//NetNext Futuroscope//EN',
+             f'X-WR-CALNAME:{name}']
+    for cycle in cycles:
+        predicted = ' (predicted)' if cycle.predicted else ''
+        version = f' for {cycle.version}' if cycle.version else ''
+        for state, start, end in [('open', cycle.day1, cycle.day2), ('closed', cycle.day2, cycle.day3)]:
+            lines += [
+                'BEGIN:VEVENT',
+                f'UID:{uid}-{state}-{start.strftime("%Y%m%d")}@netnextpredict',
+                f'DTSTAMP:{stamp}',
+                f'DTSTART;VALUE=DATE:{start.strftime("%Y%m%d")}',
+                f'DTEND;VALUE=DATE:{end.strftime("%Y%m%d")}',
+                f'SUMMARY:{name} is {state}{predicted}',
+                f'DESCRIPTION:{name} is {state}{version}: {(end - start).days} days{predicted}',
+                'TRANSP:TRANSPARENT',
+                'END:VEVENT',
+            ]
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def generate_html(cycles, now, linux_versions, outputpath, assets=None, tree=None, status=None):
+    '''
+    Render the page, cycles.json and netnext.ics unless the render inputs are unchanged since the last run.
+    Returns True if they were written.
+    With assets from build_assets() the page refers to the hashed asset names and the files are also written
+    precompressed.
+    With a tree the page and the calendar are titled for that tree instead of net-next.
+    The fetch status from fetch_history() is shown on the page and exported, so a stale page says so.
+    '''
+    import json
+    title, name = (tree.title, tree.name) if tree else ('NetNext', 'net-next')
+    with metrics.stage('render'):
+        html_filename = os.path.join(os.path.expanduser(outputpath), 'index.html')
+        json_filename = os.path.join(os.path.expanduser(outputpath), 'cycles.json')
+        ics_filename = os.path.join(os.path.expanduser(outputpath), 'netnext.ics')
+        digest_filename = os.path.join(os.path.expanduser(outputpath), '.index.html.sha256')
+        digest = render_digest('netnext.html.jinja', cycles, now, linux_versions, assets, title + name, status)
+        outputs = [html_filename, json_filename, ics_filename]
+        if all([os.path.exists(filename) for filename in outputs]) and os.path.exists(digest_filename):
+            with open(digest_filename, 'rt') as fobj:
+                if fobj.read().strip() == digest:
+                    print(f"... unchanged {html_filename}")
+                    metrics.add('cache_hits', cache='render')
+                    return False
+        metrics.add('cache_misses', cache='render')
+        html_template = get_environment().get_template('netnext.html.jinja')
+        content = {
+            'cycles': cycles,
+            'linux_versions': linux_versions,
+            'generated': now,
+            'title': title,
+            'status': status or {},
+            'assets': assets or dict([(name, name) for name in asset_sources]),
+        }
+        write_atomic(html_filename, html_template.render(content))
+        write_atomic(json_filename, json.dumps(export_cycles(cycles, now, status), indent=1))
+        write_atomic(ics_filename, cycles_ics(cycles, now, name))
+        for filename in outputs:
+            if assets:
+                precompress(filename)
+            else:
+                remove_precompressed(filename)
+            print(f"... wrote {filename}")
+        write_atomic(digest_filename, digest)
+        return True
+
+
+class StaticFiles:
+    '''
+    Keep the files of the output folder in memory with their ETag, reloading a file when its mtime changes.
+    The precompressed .br and .gz copies are used when the client accepts them.
+    Only the published files are served, like netnextinstall.service uploads them: the stores and caches kept
+    next to them in the output folder are not.
+    '''
+    encodings = [('br', '.br'), ('gzip', '.gz')]
+    published = ['index.html', 'cycles.json', 'netnext.ics']
+    published_dirs = ['css', 'images']
+
+    def is_published(self, filename):
+        name = os.path.relpath(filename, self.root)
+        for _, ext in self.encodings:
+            if name.endswith(ext):
+                name = name[:-len(ext)]
+        return name in self.published or name.split(os.sep)[0] in self.published_dirs
+
+    def __init__(self, root):
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def load(self, filename):
+        st = os.stat(filename)
+        key = (st.st_mtime_ns, st.st_size)
+        with self.lock:
+            cached = self.files.get(filename)
+            if cached and cached[0] == key:
+                return cached[1], cached[2]
+        with open(filename, 'rb') as fobj:
+            data = fobj.read()
+        etag = f'"{content_hash(data)}"'
+        with self.lock:
+            self.files[filename] = (key, data, etag)
+        return data, etag
+
+    def lookup(self, path, accept_encoding=''):
+        '''Return the data, ETag, content encoding and name of the file for a request path, or None'''
+        path = urllib.parse.unquote(urllib.parse.urlsplit(path).path)
+        if path.endswith('/'):
+            path += 'index.html'
+        filename = os.path.normpath(os.path.join(self.root, path.lstrip('/')))
+        if not filename.startswith(self.root + os.sep) or not os.path.isfile(filename):
+            return None
+        if not self.is_published(filename):
+            return None
+        accepted = [item.split(';')[0].strip() for item in accept_encoding.split(',')]
+        for encoding, ext in self.encodings:
+            if encoding in accepted and os.path.isfile(filename + ext):
+                data, etag = self.load(filename + ext)
+                return data, etag, encoding, filename
+        data, etag = self.load(filename)
+        return data, etag, None, filename
+
+
+def make_server(outputpath, port, address=''):
+    '''Serve the output folder with ETag/304 support and far future caching of the hashed assets'''
+    import http.server
+    import mimetypes
+    files = StaticFiles(outputpath)
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_HEAD(self):
+            self.do_GET(body=False)
+
+        def do_GET(self, body=True):
+            found = files.lookup(self.path, self.headers.get('Accept-Encoding', ''))
+            if found is None:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            data, etag, encoding, filename = found
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                data = b''
+            else:
+                self.send_response(200)
+                self.send_header('Content-Type', mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+            self.send_header('ETag', etag)
+            self.send_header('Vary', 'Accept-Encoding')
+            if re_hashed_asset.search(filename):
+                self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+            else:
+                self.send_header('Cache-Control', 'no-cache')
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            if body:
+                self.wfile.write(data)
+
+    return http.server.ThreadingHTTPServer((address, port), Handler)
+
+
+def start_server(outputpath, port, address=''):
+    server = make_server(outputpath, port, address)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    print(f'serving {os.path.expanduser(outputpath)} on port {server.server_address[1]}')
+    return server, thread
+
+
+class NetNextDaemon:
+    '''
+    Stay resident and keep the history, the fetch validators and the tag index in memory.
+    Each poll costs a conditional request on a kept-alive connection and a stat of the git refs, and the page is
+    only rebuilt when the history, the tags or the day changed.
+    '''
+    def __init__(self, outdir, repo=None, tz=None, model='average', count=17, interval=3600, jitter=300,
+                 assets=False, tree=None, profile=None, deadline=300, announced=False):
+        self.outdir = outdir
+        self.announced = announced
+        self.deadline = deadline
+        self.stale = False
+        self.tree = tree
+        self.profile = profile
+        self.assets = assets
+        self.repo = repo
+        self.tz = tz
+        self.model = model
+        self.count = count
+        self.interval = interval
+        self.jitter = jitter
+        self.datastorepath = get_datastore_path(outdir)
+        self.cache = FetchCache(get_datastore_path(outdir, 'fetchcache.yaml'))
+        self.index = LinuxTagIndex(get_datastore_path(outdir, 'linuxtags.yaml')) if repo else None
+        self.history = load_history(self.datastorepath)
+        self.day = None
+
+    def now(self):
+        return datetime.datetime.now(self.tz)
+
+    def poll(self):
+        '''
+        Fetch the changes and regenerate the page if needed.  Returns True if the page was rebuilt.
+        When lore.kernel.org fails the page is built from the history in memory and says that it is stale.
+        '''
+        import http.client
+        pool.set_deadline(self.deadline)
+        validators = dict(self.cache.validators)
+        try:
+            if self.tree and self.tree.inbox:
+                self.history, changed = get_inbox_history(self.datastorepath, self.tree)
+            elif self.history:
+                self.history, changed = update_history(self.history, self.cache, self.tree)
+            else:
+                self.history, changed = get_updated_history(self.tree), True
+            status = {'status': 'updated' if changed else 'unchanged', 'error': None}
+        except (OSError, http.client.HTTPException) as err:
+            if not self.history:
+                raise
+            changed = False
+            status = stale_status(err)
+        if changed:
+            save_datastore(self.datastorepath, self.history)
+        if self.cache.validators != validators:
+            self.cache.save()
+        if self.index and self.index.update(self.repo):
+            self.index.save()
+            changed = True
+        now = self.now()
+        stale = status['status'] == 'stale'
+        if not changed and now.date() == self.day and stale == self.stale:
+            return False
+        self.day = now.date()
+        self.stale = stale
+        linux_versions = self.index.tags() if self.index else None
+        constraints = None
+        if self.announced:
+            constraints = get_announcements(self.history, get_datastore_path(self.outdir, 'bodies.sqlite'), self.tree)
+        cycles = build_cycles(self.history, now.date(), linux_versions, self.count, self.model, constraints)
+        assets = build_assets(self.outdir) if self.assets else None
+        return generate_html(cycles, now, linux_versions, self.outdir, assets, self.tree, status)
+
+    def delay(self):
+        import random
+        return max(self.interval + random.uniform(-self.jitter, self.jitter), 1)
+
+    def run(self):
+        run_daemons([self], self.profile)
+
+
+def run_daemons(daemons, profile=None, rounds=None):
+    '''
+    Poll the daemons of all the trees in turn, so they share the metrics and the connection pool without one
+    poll resetting the metrics or the deadline of another.  The metrics are reset before each round and written
+    to the profile textfile after it.  With rounds it returns after that many rounds.
+    '''
+    import time
+    import http.client
+    done = 0
+    while True:
+        metrics.reset()
+        for daemon in daemons:
+            try:
+                daemon.poll()
+            except (OSError, http.client.HTTPException) as err:
+                print(f'{daemon.tree.name if daemon.tree else "net-next"} poll failed: {err}')
+                metrics.add('poll_failures')
+        if profile:
+            metrics.write(profile)
+        sys.stdout.flush()
+        done += 1
+        if rounds and done >= rounds:
+            return
+        time.sleep(min([daemon.delay() for daemon in daemons]))
+
+
+def get_timezone(name=None):
+    '''The timezone of the current date, pytz is only imported by the commands that predict'''
+    import pytz
+    return pytz.timezone(name or 'Europe/Copenhagen')
 
 
 if __name__ == '__main__':
+    import argparse
     parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('-p', '--pullreq', help='Get rc1 or rc2 pull requests', action='store_true')
     parser.add_argument('-z', '--timezone', help='Set timezone for current date', type=str, default='Europe/Copenhagen')
@@ -325,24 +2406,170 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--statusonly', help='Just get the lore.kernel.org net-next status', action='store_true')
     parser.add_argument('-c', '--cyclesonly', help='Show the net next cycles', action='store_true')
     parser.add_argument('-a', '--savestatus', help='Save the lore.kernel.org net-next status', action='store_true')
+    parser.add_argument('--html', help='Read the lore.kernel.org HTML search pages instead of the Atom feed',
+                        action='store_true')
+    parser.add_argument('--corrections', help='YAML file with the missing and excess state changes', type=str,
+                        default=corrections_path)
+    parser.add_argument('-k', '--cached', help='Start from the saved status and only fetch newer lore.kernel.org messages',
+                        action='store_true')
+    parser.add_argument('-n', '--numcycles', help='Number of historic cycles to show (0: all)', type=int, default=17)
+    parser.add_argument('-m', '--model', help='Prediction model', choices=list(prediction_models) + ['montecarlo'],
+                        default='average')
+    parser.add_argument('--probabilities', help='Show the probability of net-next being open per day (montecarlo model)',
+                        action='store_true')
+    parser.add_argument('-q', '--query', help='Answer queries about dates (2024-05-01) or ranges '
+                        '(2024-05-01..2024-06-30) as JSON, "-" reads JSON or one query per line from stdin', nargs='+',
+                        default=None)
+    parser.add_argument('-b', '--backtest', help='Replay the history day by day and write a JSON report of the '
+                        'prediction errors to this file', type=str, default=None)
+    parser.add_argument('-d', '--daemon', help='Stay resident and regenerate the HTML file when the inputs change',
+                        action='store_true')
+    parser.add_argument('-i', '--interval', help='Daemon poll interval in seconds', type=int, default=3600)
+    parser.add_argument('-j', '--jitter', help='Random daemon poll interval variation in seconds', type=int, default=300)
+    parser.add_argument('--assets', help='Write hashed, resized and precompressed assets with the HTML file',
+                        action='store_true')
+    parser.add_argument('--serve', help='Serve the output folder on this port', type=int, default=None)
+    parser.add_argument('-t', '--trees', help='YAML file with the *-next trees to track instead of net-next',
+                        type=str, default=None)
+    parser.add_argument('--profile', help='Write the stage timings and counters of the run to this Prometheus '
+                        'node exporter textfile', type=str, default=None)
+    parser.add_argument('--cprofile', help='Write a cProfile dump of the run to this file', type=str, default=None)
+    parser.add_argument('--export-yaml', help='Write the saved status to this YAML file and exit', type=str,
+                        default=None)
+    parser.add_argument('--deadline', help='Seconds lore.kernel.org may take in total before the saved status is '
+                        'used (0: no deadline)', type=float, default=300)
+    parser.add_argument('--retries', help='Number of retries of a failed lore.kernel.org request', type=int, default=3)
+    parser.add_argument('-e', '--announced', help='Read the bodies of the announcements for the open and close dates '
+                        'announced ahead of time and use them in the prediction', action='store_true')
+    parser.add_argument('-x', '--inbox', help='Read the messages from this local public-inbox mirror of netdev '
+                        'instead of the lore.kernel.org search', type=str, default=None)
+    parser.add_argument('-f', '--offline', '--from-store', help='Use the saved status and make no network requests',
+                        action='store_true')
 
     args = parser.parse_args()
+    if args.trees:
+        unsupported = [flag for flag, value in [('--savestatus', args.savestatus), ('--statusonly', args.statusonly),
+                                                ('--cyclesonly', args.cyclesonly), ('--query', args.query),
+                                                ('--backtest', args.backtest), ('--probabilities', args.probabilities),
+                                                ('--export-yaml', args.export_yaml), ('--inbox', args.inbox)] if value]
+        if unsupported:
+            parser.error(f'{", ".join(unsupported)} cannot be used with --trees')
+
+    if args.html:
+        lore_format = 'html'
+    pool.retries = args.retries
+    pool.set_deadline(None if args.daemon else args.deadline)
+    corrections_path = os.path.expanduser(args.corrections)
+    repo = os.path.expanduser(args.repo) if args.repo else None
+    pullreq = args.statusonly and args.pullreq
+    tree = NetNextTree(inbox=os.path.expanduser(args.inbox)) if args.inbox else None
+    datastorepath = get_datastore_path(args.outdir)
+    bodypath = get_datastore_path(args.outdir, 'bodies.sqlite')
+    indexpath = get_datastore_path(args.outdir, 'linuxtags.yaml')
+
+    if args.export_yaml:
+        save_yaml_history(os.path.expanduser(args.export_yaml), load_history(datastorepath))
+        sys.exit(0)
 
-    history = get_updated_history()
+    if args.cprofile:
+        import atexit
+        import cProfile
+        profiler = cProfile.Profile()
+        atexit.register(profiler.dump_stats, os.path.expanduser(args.cprofile))
+        atexit.register(profiler.disable)
+        profiler.enable()
+    if args.profile and not args.daemon:
+        import atexit
+        atexit.register(metrics.write, os.path.expanduser(args.profile))
+
+    server_thread = None
+    if args.serve is not None:
+        server, server_thread = start_server(args.outdir, args.serve)
+
+    if args.trees:
+        trees = NetNextTree.from_config(os.path.expanduser(args.trees))
+        tz = get_timezone(args.timezone)
+        if args.daemon:
+            daemons = [NetNextDaemon(tree.outdir, repo, tz, args.model, args.numcycles, args.interval, args.jitter,
+                                     args.assets, tree, deadline=args.deadline, announced=args.announced)
+                       for tree in trees]
+            run_daemons(daemons, os.path.expanduser(args.profile) if args.profile else None)
+        now = datetime.datetime.now(tz)
+        if args.offline:
+            histories = []
+            for tree in trees:
+                datastorepath = get_datastore_path(tree.outdir)
+                with metrics.stage('load'):
+                    history = load_history(datastorepath)
+                if not history:
+                    print(f'No saved status in {datastorepath}: run with --trees and --cached first')
+                    sys.exit(1)
+                histories.append((tree, history, {'status': 'offline', 'error': None}))
+            linux_versions = get_git_linux_tags(repo, indexpath) if repo else None
+        else:
+            histories, linux_versions = fetch_trees(trees, repo, indexpath, args.cached)
+        for tree, history, status in histories:
+            constraints = None
+            if args.announced:
+                constraints = get_announcements(history, get_datastore_path(tree.outdir, 'bodies.sqlite'), tree,
+                                                not args.offline)
+            cycles = build_cycles(history, now.date(), linux_versions, args.numcycles, args.model, constraints)
+            if args.generate:
+                os.makedirs(tree.outdir, exist_ok=True)
+                generate_html(cycles, now, linux_versions, tree.outdir,
+                              build_assets(tree.outdir) if args.assets else None, tree, status)
+            else:
+                print(f'{tree.title} Cycles Prediction')
+                for item in cycles:
+                    print(f'    {item}')
+        if server_thread:
+            server_thread.join()
+        sys.exit(0)
+
+    if args.daemon:
+        daemon = NetNextDaemon(args.outdir, repo, get_timezone(args.timezone), args.model, args.numcycles,
+                               args.interval, args.jitter, args.assets, tree,
+                               os.path.expanduser(args.profile) if args.profile else None,
+                               deadline=args.deadline, announced=args.announced)
+        daemon.run()
+
+    if args.offline:
+        with metrics.stage('load'):
+            history = load_history(datastorepath)
+        if not history:
+            print(f'No saved status in {datastorepath}: run with --savestatus first')
+            sys.exit(1)
+        if pullreq:
+            print('The pull requests are not saved: they are not available with --offline')
+        prs = []
+        linux_versions = get_git_linux_tags(repo, indexpath) if repo else None
+        changed = False
+        status = {'status': 'offline', 'error': None}
+    else:
+        history, changed, prs, linux_versions, status = fetch_all(pullreq, repo,
+                                                                  datastorepath if args.cached else None,
+                                                                  indexpath, datastorepath, tree)
+        if args.cached and changed:
+            save_datastore(datastorepath, history)
 
     if args.savestatus:
-        filename = 'history.yaml'
-        if args.outdir:
-            datastorepath = os.path.join(os.path.expanduser(args.outdir), filename)
-        else:
-            datastorepath = filename
-        save_datastore(datastorepath, history)
+        if not args.cached and not args.offline and status['status'] != 'stale':
+            save_datastore(datastorepath, history, replace=True)
+        sys.exit(0)
+
+    if args.backtest:
+        report = backtest(history)
+        print('Net Next Prediction Backtest')
+        for model, result in report['models'].items():
+            print(f'    {model:<12} days: {result["days"]:<6} mean error: {result["mae"]:6.2f} days, '
+                  f'within a week: {result["within_7"]:6.1%}')
+        save_report(os.path.expanduser(args.backtest), report)
         sys.exit(0)
 
     if args.statusonly:
         if args.pullreq:
             print('Net Next Emails with RC1/RC2 pull requests')
-            history += get_netnext_prs()
+            history += prs
             history = sorted(history)
         else:
             print('Net Next Status Emails')
@@ -354,20 +2581,28 @@ if __name__ == '__main__':
             last = item.date
         sys.exit(0)
 
-    cycles = generate_netnext_cycles(history)[-17:]
+    now = datetime.datetime.now(get_timezone(args.timezone))
 
-    tz = pytz.timezone('Europe/Copenhagen')
-    if args.timezone:
-        tz = pytz.timezone(args.timezone)
-    now = datetime.datetime.now(tz)
+    constraints = get_announcements(history, bodypath, tree, not args.offline) if args.announced else None
+    cycles = build_cycles(history, now.date(), linux_versions, args.numcycles, args.model, constraints)
 
-    cycles = predict(cycles, history, now.date())
+    if args.query:
+        import json
+        index = CycleIndex(cycles)
+        queries = []
+        for query in args.query:
+            queries += read_queries(sys.stdin) if query == '-' else [query]
+        print(json.dumps([index.query(query) for query in queries], indent=1))
+        sys.exit(0)
 
-    linux_versions = None
-    if args.repo:
-        linux_versions = get_git_linux_tags(os.path.expanduser(args.repo))
-        if linux_versions:
-            add_linux_versions(cycles, linux_versions)
+    if args.probabilities:
+        print('Net Next Open Probability')
+        for cycle in cycles:
+            if not cycle.predicted or not cycle.probabilities:
+                continue
+            for day, prob in cycle.probabilities.items():
+                print(f'    {day.strftime("%d-%b-%Y")} {prob:6.1%}')
+        sys.exit(0)
 
     if args.cyclesonly:
         print('Net Next Cycles')
@@ -376,9 +2611,15 @@ if __name__ == '__main__':
         sys.exit(0)
 
     if args.generate:
-        generate_html(cycles, now, linux_versions, args.outdir)
+        generate_html(cycles, now, linux_versions, args.outdir, build_assets(args.outdir) if args.assets else None,
+                      status=status)
     else:
+        if status['status'] == 'stale':
+            print(f'Net Next Cycles Prediction from the saved status: lore.kernel.org failed: {status["error"]}')
         print('Net Next Cycles Prediction')
         for item in cycles:
             print(f'    {item}')
 
+    if server_thread:
+        server_thread.join()
+
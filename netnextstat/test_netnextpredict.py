@@ -0,0 +1,1358 @@
+import datetime
+import http.server
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+import urllib.parse
+import urllib.request
+import gzip
+import json
+import random
+import netnext_git
+import netnext_testdata
+import netnextpredict
+
+
+def synthetic_history(cycles=12, first=datetime.date(2021, 1, 4), open_days=63, closed_days=14):
+    history = []
+    day = first
+    for idx in range(cycles):
+        history.append(netnextpredict.NetNextStateChange('net-next is Open', str(day)))
+        day += datetime.timedelta(days=open_days)
+        history.append(netnextpredict.NetNextStateChange('net-next is Closed', str(day)))
+        day += datetime.timedelta(days=closed_days)
+    return history
+
+
+def git(repo, *args, date=None, author='Linus', data=None):
+    env = dict(os.environ, GIT_AUTHOR_NAME=author, GIT_AUTHOR_EMAIL='linus@example.org', GIT_COMMITTER_NAME='Linus',
+               GIT_COMMITTER_EMAIL='linus@example.org')
+    if date:
+        env.update(GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date)
+    return subprocess.run(['git', '-C', repo] + list(args), env=env, check=True, capture_output=True,
+                          input=data).stdout.decode().strip()
+
+
+def make_linux_repo(repo, versions):
+    git(repo, 'init', '-q')
+    for version, date in versions:
+        add_linux_tag(repo, version, date)
+
+
+def add_linux_tag(repo, version, date):
+    git(repo, 'commit', '-q', '--allow-empty', '-m', f'Linux {version}-rc1', date=date)
+    git(repo, 'tag', '-a', f'v{version}-rc1-net', '-m', f'Linux {version}-rc1', date=date)
+
+
+class LoreHandler(http.server.BaseHTTPRequestHandler):
+    '''A tiny stand-in for the lore.kernel.org search pages'''
+    etag = '"lore-1"'
+    messages = [
+        ('net-next is OPEN', 'Jakub Kicinski', '2024-01-08 16:14'),
+        ('net-next is CLOSED', 'Jakub Kicinski', '2024-03-10 20:01'),
+        ('net-next is OPEN', 'Jakub Kicinski', '2024-03-25 15:43'),
+    ]
+    default_messages = messages
+    requests = []
+    # The plain text bodies by Message-ID and the paths of the raw message requests
+    bodies = {}
+    raws = []
+    # Answer 503 to the next failures requests and wait delay seconds before each answer
+    failures = 0
+    delay = 0
+    # Answer the searches with an HTML page instead of the Atom feed
+    malformed = False
+
+    def log_message(self, *args):
+        pass
+
+    @staticmethod
+    def msgid(when):
+        return f'{when.replace("-", "").replace(" ", ".").replace(":", "")}@kernel.org'
+
+    def raw(self, msgid):
+        body = LoreHandler.bodies.get(msgid)
+        if body is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        data = (f'From: Jakub Kicinski <kuba@kernel.org>\nMessage-ID: <{msgid}>\n'
+                f'Content-Type: text/plain; charset=utf-8\n\n{body}').encode()
+        self.send_response(200)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            data = gzip.compress(data)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def atom(self, messages):
+        entries = []
+        for subject, author, when in messages:
+            entries.append(f'<entry><author><name>{author}</name><email>a@b.org</email></author><title>{subject}</title>'
+                           f'<updated>{when.replace(" ", "T")}:00Z</updated>'
+                           f'<link href="http://lore.kernel.org/netdev/{self.msgid(when)}/"/>'
+                           f'<content type="xhtml"><div>body</div></content></entry>')
+        return f'<?xml version="1.0"?><feed xmlns="http://www.w3.org/2005/Atom">{"".join(entries)}</feed>'.encode()
+
+    def page(self, messages):
+        lines = []
+        for subject, author, when in messages:
+            lines.append(f'<b><a href="{self.msgid(when)}/">{subject}</a></b>\n - by {author} @ {when} UTC [100%]\n')
+        return f'<html><body><pre>{"".join(lines)}</pre></body></html>'.encode()
+
+    def do_GET(self):
+        path = urllib.parse.urlparse(self.path).path
+        if path.startswith('/moved/'):
+            self.send_response(301)
+            self.send_header('Location', self.path.replace('/moved/', '/netdev/', 1))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if path.endswith('/raw'):
+            LoreHandler.raws.append(path)
+            return self.raw(urllib.parse.unquote(path.split('/')[-2]))
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        LoreHandler.requests.append(query)
+        time.sleep(LoreHandler.delay)
+        if LoreHandler.failures:
+            LoreHandler.failures -= 1
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == LoreHandler.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        messages = sorted(LoreHandler.messages, key=lambda msg: msg[2], reverse=True)
+        since = [word[2:-2] for word in query.get('q', [''])[0].split() if word.startswith('d:')]
+        if since:
+            limit = datetime.datetime.strptime(since[0], '%Y%m%d').strftime('%Y-%m-%d')
+            messages = [msg for msg in messages if msg[2] >= limit]
+        offset = int(query.get('o', ['0'])[0])
+        messages = messages[offset:offset + netnextpredict.lore_page_size]
+        body = self.atom(messages) if query.get('x') == ['A'] else self.page(messages)
+        if LoreHandler.malformed:
+            body = b'<html><body><p>Checking your browser</body></html>'
+        self.send_response(200)
+        self.send_header('ETag', LoreHandler.etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class LoreTestCase(unittest.TestCase):
+    def setUp(self):
+        LoreHandler.requests = []
+        LoreHandler.raws = []
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), LoreHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.saved_uri = netnextpredict.lore_uri
+        netnextpredict.lore_uri = f'http://127.0.0.1:{self.server.server_address[1]}/netdev/'
+        self.saved_page_size = netnextpredict.lore_page_size
+        self.saved_backoff = netnextpredict.pool.backoff
+        netnextpredict.pool.backoff = 0.01
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.datastore = os.path.join(self.tmpdir.name, 'history.sqlite')
+
+    def tearDown(self):
+        netnextpredict.lore_uri = self.saved_uri
+        netnextpredict.lore_page_size = self.saved_page_size
+        netnextpredict.lore_format = 'atom'
+        LoreHandler.messages = LoreHandler.default_messages
+        LoreHandler.bodies = {}
+        LoreHandler.failures = 0
+        LoreHandler.delay = 0
+        LoreHandler.malformed = False
+        netnextpredict.pool.backoff = self.saved_backoff
+        netnextpredict.pool.set_deadline(None)
+        netnextpredict.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+
+
+class TestCachedHistory(LoreTestCase):
+    def stored_history(self):
+        return [
+            netnextpredict.NetNextStateChange('net-next is Open', '2024-01-08'),
+            netnextpredict.NetNextStateChange('net-next is Closed', '2024-03-10'),
+        ]
+
+    def test_merge_newer_messages(self):
+        netnextpredict.save_datastore(self.datastore, self.stored_history())
+        history, changed = netnextpredict.get_cached_history(self.datastore)
+        self.assertTrue(changed)
+        self.assertEqual([str(item.date) for item in history], ['2024-01-08', '2024-03-10', '2024-03-25'])
+        self.assertEqual(history[-1].state, 'Open')
+        self.assertIn('d:20240310..', LoreHandler.requests[0]['q'][0])
+
+    def test_not_modified(self):
+        netnextpredict.save_datastore(self.datastore, self.stored_history())
+        netnextpredict.get_cached_history(self.datastore)
+        history, changed = netnextpredict.get_cached_history(self.datastore)
+        self.assertFalse(changed)
+        self.assertEqual(len(history), 2)
+        self.assertEqual(len(LoreHandler.requests), 2)
+
+    def test_roundtrip_datastore(self):
+        netnextpredict.save_datastore(self.datastore, self.stored_history())
+        history = netnextpredict.load_history(self.datastore)
+        self.assertEqual([(item.state, item.date) for item in history],
+                         [(item.state, item.date) for item in self.stored_history()])
+
+
+class TestCrawl(LoreTestCase):
+    def test_follow_all_pages(self):
+        netnextpredict.lore_page_size = 2
+        LoreHandler.messages = LoreHandler.messages + [
+            ('net-next is CLOSED', 'Jakub Kicinski', '2023-11-12 10:00'),
+            ('Re: net-next is CLOSED', 'Someone Else', '2023-11-12 11:00'),
+            ('net-next is OPEN', 'Jakub Kicinski', '2023-09-11 09:00'),
+        ]
+        history = sorted(netnextpredict.get_netnext_history())
+        self.assertEqual([str(item.date) for item in history],
+                         ['2023-09-11', '2023-11-12', '2024-01-08', '2024-03-10', '2024-03-25'])
+        offsets = sorted(set([int(query.get('o', ['0'])[0]) for query in LoreHandler.requests]))
+        self.assertEqual(offsets[:3], [0, 2, 4])
+
+    def test_stop_at_history_limit(self):
+        netnextpredict.lore_page_size = 1
+        LoreHandler.messages = LoreHandler.messages + [
+            ('net-next is OPEN', 'David Miller', '2017-01-02 09:00'),
+            ('net-next is CLOSED', 'David Miller', '2016-11-02 09:00'),
+            ('net-next is OPEN', 'David Miller', '2016-09-02 09:00'),
+            ('net-next is CLOSED', 'David Miller', '2016-07-02 09:00'),
+            ('net-next is OPEN', 'David Miller', '2016-05-02 09:00'),
+        ]
+        history = netnextpredict.get_netnext_history()
+        self.assertEqual(len(history), 3)
+        self.assertLess(len(LoreHandler.requests), len(LoreHandler.messages))
+
+    def test_html_pages(self):
+        netnextpredict.lore_format = 'html'
+        netnextpredict.lore_page_size = 2
+        history = sorted(netnextpredict.get_netnext_history())
+        self.assertEqual([str(item.date) for item in history], ['2024-01-08', '2024-03-10', '2024-03-25'])
+        self.assertNotIn('x', LoreHandler.requests[0])
+
+
+class TestHttpPool(LoreTestCase):
+    def test_proxy(self):
+        proxy = netnextpredict.lore_uri.rsplit('/netdev/', 1)[0]
+        netnextpredict.lore_uri = 'http://lore.invalid/netdev/'
+        with unittest.mock.patch.dict(os.environ, {'http_proxy': proxy, 'no_proxy': ''}):
+            history = netnextpredict.get_netnext_history()
+        self.assertEqual(len(history), 3)
+
+    def test_redirect(self):
+        netnextpredict.lore_uri = netnextpredict.lore_uri.replace('/netdev/', '/moved/')
+        history = netnextpredict.get_netnext_history()
+        self.assertEqual(len(history), 3)
+
+    def test_workers_kept(self):
+        netnextpredict.get_netnext_history()
+        workers = netnextpredict.pool.workers
+        connections = len(netnextpredict.pool.connections)
+        netnextpredict.get_netnext_history()
+        self.assertIs(netnextpredict.pool.workers, workers)
+        self.assertEqual(len(netnextpredict.pool.connections), connections)
+        netnextpredict.pool.close()
+        self.assertIsNone(netnextpredict.pool.workers)
+        self.assertEqual(netnextpredict.pool.connections, [])
+
+
+class TestFetchDeadline(LoreTestCase):
+    def test_retry_server_errors(self):
+        LoreHandler.failures = 2
+        data = netnextpredict.pool.fetch(netnextpredict.lore_query_uri(netnextpredict.state_query))
+        self.assertIn(b'net-next is OPEN', data)
+        self.assertEqual(len(LoreHandler.requests), 3)
+        self.assertGreaterEqual(netnextpredict.metrics.counters.get(('lore_retries', ()), 0), 2)
+
+    def test_give_up_after_retries(self):
+        LoreHandler.failures = 10
+        with self.assertRaises(urllib.error.HTTPError):
+            netnextpredict.pool.fetch(netnextpredict.lore_query_uri(netnextpredict.state_query))
+        self.assertEqual(len(LoreHandler.requests), netnextpredict.pool.retries + 1)
+
+    def test_stale_after_deadline(self):
+        netnextpredict.save_datastore(self.datastore, synthetic_history(cycles=2))
+        LoreHandler.delay = 1
+        netnextpredict.pool.set_deadline(0.3)
+        start = time.monotonic()
+        history, changed, status = netnextpredict.fetch_history(self.datastore)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(len(history), 4)
+        self.assertFalse(changed)
+        self.assertEqual(status['status'], 'stale')
+
+    def test_stale_malformed_feed(self):
+        netnextpredict.save_datastore(self.datastore, synthetic_history(cycles=2))
+        LoreHandler.malformed = True
+        history, changed, status = netnextpredict.fetch_history(self.datastore, self.datastore)
+        self.assertEqual(len(history), 4)
+        self.assertFalse(changed)
+        self.assertEqual(status['status'], 'stale')
+        self.assertIn('malformed', status['error'])
+        daemon = netnextpredict.NetNextDaemon(self.tmpdir.name, jitter=0)
+        daemon.now = lambda: datetime.datetime(2024, 4, 1, 12, 0)
+        self.assertTrue(daemon.poll())
+
+    def test_stale_page(self):
+        netnextpredict.save_datastore(self.datastore, synthetic_history(cycles=3, first=datetime.date(2023, 4, 24)))
+        LoreHandler.failures = 10
+        daemon = netnextpredict.NetNextDaemon(self.tmpdir.name, jitter=0)
+        daemon.now = lambda: datetime.datetime(2024, 4, 1, 12, 0)
+        self.assertTrue(daemon.poll())
+        with open(os.path.join(self.tmpdir.name, 'index.html'), 'rt') as fobj:
+            self.assertIn('could not be reached', fobj.read())
+        with open(os.path.join(self.tmpdir.name, 'cycles.json'), 'rt') as fobj:
+            self.assertEqual(json.load(fobj)['fetch']['status'], 'stale')
+        LoreHandler.failures = 0
+        self.assertTrue(daemon.poll())
+
+
+class TestTrees(LoreTestCase):
+    def write_config(self):
+        config = os.path.join(self.tmpdir.name, 'trees.yaml')
+        base = netnextpredict.lore_uri.rsplit('/netdev/', 1)[0]
+        with open(config, 'wt') as fobj:
+            fobj.write(f"""trees:
+  - name: net-next
+    uri: {base}/netdev/
+    outdir: net
+  - name: bpf-next
+    title: BpfNext
+    uri: {base}/bpf/
+    query: 's:"bpf-next is "'
+    regex: 'bpf-next is (OPEN|CLOSED)'
+    outdir: bpf
+""")
+        return config
+
+    def setUp(self):
+        super().setUp()
+        LoreHandler.messages = LoreHandler.messages + [
+            ('bpf-next is CLOSED', 'Alexei Starovoitov', '2024-03-11 08:00'),
+            ('bpf-next is OPEN', 'Alexei Starovoitov', '2024-03-26 08:00'),
+        ]
+
+    def test_fetch_trees(self):
+        trees = netnextpredict.NetNextTree.from_config(self.write_config())
+        self.assertEqual([tree.outdir for tree in trees],
+                         [os.path.join(self.tmpdir.name, 'net'), os.path.join(self.tmpdir.name, 'bpf')])
+        histories, tags = netnextpredict.fetch_trees(trees)
+        self.assertIsNone(tags)
+        self.assertEqual([str(item.date) for item in sorted(histories[0][1])], ['2024-01-08', '2024-03-10', '2024-03-25'])
+        self.assertEqual([(str(item.date), item.state) for item in sorted(histories[1][1])],
+                         [('2024-03-11', 'Closed'), ('2024-03-26', 'Open')])
+
+    def test_cached_trees(self):
+        trees = netnextpredict.NetNextTree.from_config(self.write_config())
+        for tree in trees:
+            os.makedirs(tree.outdir)
+        netnextpredict.fetch_trees(trees, cached=True)
+        for tree in trees:
+            self.assertTrue(os.path.exists(os.path.join(tree.outdir, 'history.sqlite')))
+        LoreHandler.requests = []
+        histories, tags = netnextpredict.fetch_trees(trees, cached=True)
+        self.assertEqual(len(histories[0][1]), 3)
+        self.assertEqual(sorted([query['q'][0].split()[-1] for query in LoreHandler.requests]),
+                         ['d:20240325..', 'd:20240326..'])
+
+    def test_offline_trees(self):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'netnextpredict.py')
+        config = self.write_config()
+        cp = subprocess.run([sys.executable, script, '--trees', config, '--offline'], capture_output=True, text=True)
+        self.assertEqual(cp.returncode, 1, cp.stderr)
+        self.assertIn('No saved status', cp.stdout)
+        for tree in netnextpredict.NetNextTree.from_config(config):
+            netnextpredict.save_datastore(netnextpredict.get_datastore_path(tree.outdir), synthetic_history())
+        cp = subprocess.run([sys.executable, script, '--trees', config, '--offline'], capture_output=True, text=True)
+        self.assertEqual(cp.returncode, 0, cp.stderr)
+        self.assertIn('BpfNext Cycles Prediction', cp.stdout)
+        self.assertEqual(LoreHandler.requests, [])
+
+    def test_unsupported_flags(self):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'netnextpredict.py')
+        cp = subprocess.run([sys.executable, script, '--trees', self.write_config(), '--savestatus', '--cyclesonly'],
+                            capture_output=True, text=True)
+        self.assertEqual(cp.returncode, 2)
+        self.assertIn('--savestatus, --cyclesonly cannot be used with --trees', cp.stderr)
+
+
+class TestMetrics(LoreTestCase):
+    def setUp(self):
+        super().setUp()
+        netnextpredict.metrics.reset()
+
+    def test_crawl_metrics(self):
+        history = netnextpredict.get_netnext_history()
+        netnextpredict.build_cycles(history, datetime.date(2024, 4, 1))
+        metrics = netnextpredict.metrics
+        self.assertGreater(metrics.counters[('downloaded_bytes', ())], 0)
+        self.assertEqual(len(metrics.latency), len(LoreHandler.requests))
+        self.assertEqual(metrics.gauges['events'], 3)
+        for stage in ['lore', 'parse', 'cycles', 'predict']:
+            self.assertIn(stage, metrics.stages)
+
+    def test_cache_hits(self):
+        cache = netnextpredict.FetchCache(os.path.join(self.tmpdir.name, 'fetchcache.yaml'))
+        uri = netnextpredict.lore_query_uri(netnextpredict.state_query)
+        cache.fetch(uri)
+        cache.fetch(uri)
+        self.assertEqual(netnextpredict.metrics.counters[('cache_hits', (('cache', 'lore'),))], 1)
+        self.assertEqual(netnextpredict.metrics.counters[('cache_misses', (('cache', 'lore'),))], 1)
+
+    def test_textfile(self):
+        with netnextpredict.metrics.stage('fetch'):
+            netnextpredict.metrics.add('cache_hits', cache='tags')
+        filename = os.path.join(self.tmpdir.name, 'netnextpredict.prom')
+        netnextpredict.metrics.write(filename)
+        with open(filename, 'rt') as fobj:
+            lines = fobj.read().splitlines()
+        self.assertIn('# TYPE netnextpredict_stage_seconds gauge', lines)
+        self.assertIn('netnextpredict_stage_calls{stage="fetch"} 1', lines)
+        self.assertIn('netnextpredict_cache_hits{cache="tags"} 1', lines)
+        self.assertIn('netnextpredict_lore_request_seconds_count 0', lines)
+        for line in lines:
+            if not line.startswith('#'):
+                float(line.rsplit(' ', 1)[1])
+
+
+class TestAnnouncements(LoreTestCase):
+    closed = '2024-03-10 20:01'
+
+    def test_announced_dates(self):
+        sent = datetime.date(2023, 11, 26)
+        body = ('Hi!\n\nnet-next is closed until Monday, Dec 4th.\n'
+                '> We will reopen on Nov 30th.\n\n'
+                'The merge window closes on 2023-12-10, net-next will then reopen on 18th of December.\n'
+                'It closed on Nov 20.\n-- \nJakub, reopen on Jan 2\n')
+        self.assertEqual(netnextpredict.announced_dates(body, sent), {
+            datetime.date(2023, 12, 4): 'Open',
+            datetime.date(2023, 12, 10): 'Closed',
+            datetime.date(2023, 12, 18): 'Open',
+        })
+        body = 'net-next is closed through Jan 7, so it reopens after the holidays.'
+        self.assertEqual(netnextpredict.announced_dates(body, datetime.date(2023, 12, 22)),
+                         {datetime.date(2024, 1, 8): 'Open'})
+
+    def test_bodies_cached_by_message_id(self):
+        msgid = LoreHandler.msgid(self.closed)
+        LoreHandler.bodies = {msgid: 'Hi!\n\nnet-next is closed, we will reopen on Monday, March 25th.\n'}
+        history = netnextpredict.get_netnext_history()
+        self.assertIn(msgid, [item.msgid for item in history])
+        bodypath = os.path.join(self.tmpdir.name, 'bodies.sqlite')
+        announcements = netnextpredict.get_announcements(history, bodypath)
+        self.assertEqual(announcements, {datetime.date(2024, 3, 25): 'Open'})
+        # The other two messages have no body and are asked for again, the cached one is not
+        self.assertEqual(len(LoreHandler.raws), 3)
+        netnextpredict.get_announcements(history, bodypath)
+        self.assertEqual(len(LoreHandler.raws), 5)
+        self.assertEqual(LoreHandler.raws.count(f'/netdev/{msgid}/raw'), 1)
+        self.assertEqual(netnextpredict.get_announcements([], bodypath, fetch=False), announcements)
+
+    def test_html_message_ids(self):
+        netnextpredict.lore_format = 'html'
+        history = sorted(netnextpredict.get_netnext_history())
+        self.assertEqual(history[1].msgid, LoreHandler.msgid(self.closed))
+
+    def test_inflate_while_streaming(self):
+        body = 'net-next closes on Apr 1st\n' * 20000
+        LoreHandler.bodies = {'big@kernel.org': body}
+        uri = netnextpredict.message_uri('big@kernel.org')
+        chunks = list(netnextpredict.pool.inflated_chunks(uri, size=1024))
+        self.assertGreater(len(chunks), 2)
+        self.assertTrue(b''.join(chunks).endswith(body.encode()))
+        self.assertEqual(netnextpredict.fetch_message_body(uri), body)
+
+
+class TestHistoryStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, 'history.sqlite')
+        self.history = synthetic_history()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_append_new_events(self):
+        with netnextpredict.HistoryStore(self.filename) as store:
+            self.assertEqual(store.append(self.history[:10]), 10)
+            self.assertEqual(store.append(self.history[:10]), 0)
+            self.assertEqual(store.append(self.history), len(self.history) - 10)
+            self.assertEqual(store.last(), self.history[-1].date)
+        self.assertEqual([(item.date, item.state) for item in netnextpredict.load_history(self.filename)],
+                         [(item.date, item.state) for item in self.history])
+
+    def test_range_query(self):
+        netnextpredict.save_datastore(self.filename, self.history)
+        since, until = self.history[4].date, self.history[7].date
+        self.assertEqual([item.date for item in netnextpredict.load_history(self.filename, since, until)],
+                         [item.date for item in self.history[4:8]])
+
+    def test_replace(self):
+        netnextpredict.save_datastore(self.filename, self.history)
+        netnextpredict.save_datastore(self.filename, self.history[2:], replace=True)
+        self.assertEqual(len(netnextpredict.load_history(self.filename)), len(self.history) - 2)
+
+    def test_yaml_migration_and_export(self):
+        yamlname = os.path.join(self.tmpdir.name, 'history.yaml')
+        netnextpredict.save_datastore(yamlname, self.history)
+        self.assertEqual(len(netnextpredict.load_history(self.filename)), len(self.history))
+        self.assertTrue(os.path.exists(self.filename))
+        exported = os.path.join(self.tmpdir.name, 'export.yaml')
+        with netnextpredict.HistoryStore(self.filename) as store:
+            store.export_yaml(exported)
+        with open(yamlname, 'rt') as original, open(exported, 'rt') as fobj:
+            self.assertEqual(fobj.read(), original.read())
+
+
+class TestAtomParser(unittest.TestCase):
+    feed = (b'<?xml version="1.0"?><feed xmlns="http://www.w3.org/2005/Atom">'
+            b'<entry><author><name>Jakub Kicinski</name></author><title>net-next is OPEN</title>'
+            b'<updated>2024-01-08T16:14:00Z</updated></entry>'
+            b'<entry><author><name>Paolo Abeni</name></author><title>Re: net-next is OPEN</title>'
+            b'<updated>2024-01-08T18:00:00+02:00</updated></entry>'
+            b'<entry><author><name>Paolo Abeni</name></author><title>[GIT PULL] Networking for 6.8-rc1</title>'
+            b'<updated>2024-01-09T01:30:00+02:00</updated></entry>'
+            b'</feed>')
+
+    def test_split_chunks(self):
+        chunks = [self.feed[idx:idx + 7] for idx in range(0, len(self.feed), 7)]
+        res, entries = netnextpredict.parse_lore_atom(chunks, netnextpredict.re_state, netnextpredict.NetNextStateChange)
+        self.assertEqual(entries, 3)
+        self.assertEqual(len(res), 1)
+        self.assertEqual(res[0].state, 'Open')
+        self.assertEqual(res[0]._author, 'Jakub Kicinski')
+        self.assertEqual(res[0]._datetime, datetime.datetime(2024, 1, 8, 16, 14))
+
+    def test_utc_date(self):
+        res, entries = netnextpredict.parse_lore_atom([self.feed], netnextpredict.re_pull_rc1,
+                                                      netnextpredict.NetNextPullRequest)
+        self.assertEqual(res[0].state, '6.8-rc1')
+        self.assertEqual(res[0]._datetime, datetime.datetime(2024, 1, 8, 23, 30))
+
+
+class TestOffline(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.datastore = os.path.join(self.tmpdir.name, 'history.yaml')
+        netnextpredict.save_datastore(self.datastore, synthetic_history())
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_build_cycles(self):
+        history = netnextpredict.load_history(self.datastore)
+        cycles = netnextpredict.build_cycles(history, history[-1].date)
+        self.assertEqual(len(cycles), 11 + 3)
+        self.assertEqual(cycles[-1].open.days, 63)
+        self.assertTrue(cycles[-1].predicted)
+
+    def test_generate_offline(self):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'netnextpredict.py')
+        cp = subprocess.run([sys.executable, script, '--offline', '--generate', '--outdir', self.tmpdir.name],
+                            env=dict(os.environ, XDG_CACHE_HOME=self.tmpdir.name), capture_output=True)
+        self.assertEqual(cp.returncode, 0, cp.stderr)
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir.name, 'index.html')))
+
+    def test_missing_store(self):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'netnextpredict.py')
+        cp = subprocess.run([sys.executable, script, '--offline', '--outdir', os.path.join(self.tmpdir.name, 'none')],
+                            capture_output=True)
+        self.assertEqual(cp.returncode, 1)
+
+
+class TestImportTime(unittest.TestCase):
+    '''
+    Import a byte compiled copy of the module, as an installed script is, so the budget does not depend on
+    PYTHONDONTWRITEBYTECODE or on a stale __pycache__.
+    '''
+    budget_ms = int(os.environ.get('NETNEXT_IMPORT_BUDGET_MS', '80'))
+    lazy_modules = ['bs4', 'yaml', 'pytz', 'jinja2', 'urllib.request', 'http.client', 'subprocess']
+
+    @classmethod
+    def setUpClass(cls):
+        import py_compile
+        import shutil
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        filename = os.path.join(cls.tmpdir.name, 'netnextpredict.py')
+        shutil.copy(netnextpredict.__file__, filename)
+        py_compile.compile(filename, doraise=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def importtime(self, *args):
+        args = args or ['-c', 'import netnextpredict']
+        cp = subprocess.run([sys.executable, '-X', 'importtime', *args], cwd=self.tmpdir.name, capture_output=True,
+                            text=True)
+        self.assertEqual(cp.returncode, 0, cp.stderr)
+        modules = {}
+        for line in cp.stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[1].strip().isdigit():
+                modules[fields[2].strip()] = int(fields[1])
+        return modules
+
+    def test_lazy_modules(self):
+        modules = self.importtime()
+        for name in self.lazy_modules:
+            self.assertNotIn(name, modules)
+
+    def test_lazy_commands(self):
+        filename = os.path.join(self.tmpdir.name, 'netnextpredict.py')
+        modules = self.importtime(filename, '-o', self.tmpdir.name, '--export-yaml', 'history.yaml')
+        self.assertIn('yaml', modules)
+        self.assertNotIn('pytz', modules)
+
+    def test_budget(self):
+        cumulative = min([self.importtime()['netnextpredict'] for idx in range(3)])
+        self.assertLess(cumulative / 1000, self.budget_ms)
+
+
+class TestLinuxTagIndex(unittest.TestCase):
+    versions = [('6.6', '2023-09-10T15:30:00-07:00'), ('6.7', '2023-11-12T15:30:00-08:00'),
+                ('6.8', '2024-01-21T15:30:00-08:00')]
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.repo = os.path.join(self.tmpdir.name, 'linux')
+        os.makedirs(self.repo)
+        make_linux_repo(self.repo, self.versions)
+        self.indexpath = os.path.join(self.tmpdir.name, 'store', 'linuxtags.yaml')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_same_as_git_listing(self):
+        expected = [str(tag) for tag in netnextpredict.get_git_linux_tags(self.repo)]
+        self.assertEqual(expected, ['2023-09-10: Linux 6.6', '2023-11-12: Linux 6.7', '2024-01-21: Linux 6.8'])
+        self.assertEqual([str(tag) for tag in netnextpredict.get_git_linux_tags(self.repo, self.indexpath)], expected)
+
+    def test_unchanged_repo(self):
+        netnextpredict.get_git_linux_tags(self.repo, self.indexpath)
+        index = netnextpredict.LinuxTagIndex(self.indexpath)
+        self.assertFalse(index.update(self.repo))
+        self.assertEqual(index.runs, 0)
+        self.assertEqual(len(index.tags()), 3)
+
+    def test_new_tag(self):
+        netnextpredict.get_git_linux_tags(self.repo, self.indexpath)
+        add_linux_tag(self.repo, '6.9', '2024-03-24T15:30:00-07:00')
+        index = netnextpredict.LinuxTagIndex(self.indexpath)
+        self.assertTrue(index.update(self.repo))
+        self.assertEqual(index.runs, 0)
+        self.assertEqual(str(index.tags()[-1]), '2024-03-24: Linux 6.9')
+
+    def test_unsupported_format(self):
+        with open(os.path.join(self.repo, '.git', 'config'), 'at') as fobj:
+            fobj.write('[extensions]\n\tobjectformat = sha256\n')
+        with self.assertRaises(netnext_git.GitError):
+            netnext_git.Repository(self.repo)
+
+    def test_git_fallback(self):
+        expected = [str(tag) for tag in netnextpredict.get_git_linux_tags(self.repo)]
+        failing = unittest.mock.patch.object(netnext_git, 'Repository',
+                                             side_effect=netnext_git.GitError('unsupported repository format'))
+        with failing:
+            self.assertEqual([str(tag) for tag in netnextpredict.get_git_linux_tags(self.repo)], expected)
+            index = netnextpredict.LinuxTagIndex(self.indexpath)
+            self.assertTrue(index.update(self.repo))
+        self.assertEqual(index.runs, 2)
+        self.assertEqual([str(tag) for tag in index.tags()], expected)
+
+
+class TestGitReader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.repo = os.path.join(self.tmpdir.name, 'linux')
+        os.makedirs(self.repo)
+        make_linux_repo(self.repo, TestLinuxTagIndex.versions)
+        git(self.repo, 'tag', 'v6.8-rc1-light')
+        git(self.repo, 'tag', '-a', 'v6.9-rc1-net', '-m', 'Linux 6.9-rc1\nsecond line\n\nbody',
+            date='2024-03-24T15:30:00+05:30')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def git_lines(self):
+        cp = subprocess.run(['git', '-C', self.repo, 'tag', '-l', f'--format={netnextpredict.tag_format}',
+                             '--sort=taggerdate'], capture_output=True, check=True)
+        return [line for line in cp.stdout.decode().split('\n') if '-rc1' in line and line.split(';')[1]]
+
+    def test_loose_objects(self):
+        self.assertEqual(netnext_git.tag_lines(self.repo, lambda name: '-rc1' in name), self.git_lines())
+
+    def test_packed(self):
+        git(self.repo, 'gc', '-q')
+        self.assertFalse(os.listdir(os.path.join(self.repo, '.git', 'refs', 'tags')))
+        self.assertEqual(netnext_git.tag_lines(self.repo, lambda name: '-rc1' in name), self.git_lines())
+        self.assertEqual([str(tag) for tag in netnextpredict.get_git_linux_tags(self.repo)],
+                         ['2023-09-10: Linux 6.6', '2023-11-12: Linux 6.7', '2024-01-21: Linux 6.8',
+                          '2024-03-24: Linux 6.9'])
+
+    def test_deltas(self):
+        filename = os.path.join(self.repo, 'MAINTAINERS')
+        for idx in range(5):
+            with open(filename, 'at') as fobj:
+                fobj.write(''.join([f'line {line} of version {idx}\n' for line in range(200)]))
+            git(self.repo, 'add', 'MAINTAINERS')
+            git(self.repo, 'commit', '-q', '-m', f'version {idx}')
+        git(self.repo, 'repack', '-q', '-a', '-d', '-f', '--depth=10', '--window=10')
+        cp = subprocess.run(['git', '-C', self.repo, 'rev-list', '--objects', '--all'], capture_output=True, check=True)
+        with netnext_git.Repository(self.repo) as repository:
+            for line in cp.stdout.decode().split('\n'):
+                if not line:
+                    continue
+                sha = line.split()[0]
+                data = subprocess.run(['git', '-C', self.repo, 'cat-file', '-p', sha], capture_output=True).stdout
+                kind, content = repository.read(sha)
+                if kind in ['blob', 'tag', 'commit']:
+                    self.assertEqual(content, data)
+
+
+class TestPublicInbox(unittest.TestCase):
+    '''A v2 public-inbox: each message is a commit of the m file, with the subject as the commit message'''
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.inbox = os.path.join(self.tmpdir.name, 'netdev')
+        self.datastore = os.path.join(self.tmpdir.name, 'out', 'history.sqlite')
+        self.tree = netnextpredict.NetNextTree(inbox=self.inbox, corrections=netnextpredict.Corrections())
+        self.add_message(0, 'net-next is OPEN', 'Jakub Kicinski', '2024-01-08 16:14')
+        self.add_message(0, '[PATCH net-next] net: fix a leak', 'Someone Else', '2024-02-01 10:00')
+        self.add_message(0, 'Re: net-next is OPEN', 'Someone Else', '2024-01-09 10:00')
+        self.add_message(0, 'net-next is CLOSED', 'Jakub Kicinski', '2024-03-10 20:01',
+                         'Hi!\n\nnet-next is closed, we will reopen on Monday, March 25th.\n')
+        self.add_message(0, '[GIT PULL] Networking for 6.9-rc1', 'Jakub Kicinski', '2024-03-21 18:00')
+        self.add_message(1, 'net-next is OPEN', 'Jakub Kicinski', '2024-03-25 15:43')
+
+    def tearDown(self):
+        netnextpredict.metrics.reset()
+        self.tmpdir.cleanup()
+
+    def add_message(self, epoch, subject, author, when, body='body\n'):
+        repo = os.path.join(self.inbox, 'git', f'{epoch}.git')
+        if not os.path.exists(repo):
+            os.makedirs(repo)
+            git(repo, 'init', '-q', '--bare')
+        date = f'{when}:00 +0000'
+        msgid = LoreHandler.msgid(when)
+        message = f'From: {author} <a@b.org>\nSubject: {subject}\nMessage-ID: <{msgid}>\n\n{body}'
+        blob = git(repo, 'hash-object', '-w', '--stdin', data=message.encode())
+        tree = git(repo, 'mktree', data=f'100644 blob {blob}\tm\n'.encode())
+        parents = []
+        if os.path.exists(os.path.join(repo, 'refs', 'heads', 'master')):
+            parents = ['-p', 'refs/heads/master']
+        commit = git(repo, 'commit-tree', tree, *parents, '-m', subject, date=date, author=author)
+        git(repo, 'update-ref', 'refs/heads/master', commit)
+
+    def test_read_inbox(self):
+        history, changed = netnextpredict.get_inbox_history(self.datastore, self.tree)
+        self.assertTrue(changed)
+        self.assertEqual([(str(item.date), item.state) for item in history],
+                         [('2024-01-08', 'Open'), ('2024-03-10', 'Closed'), ('2024-03-25', 'Open')])
+        self.assertEqual(history[1].msgid, LoreHandler.msgid('2024-03-10 20:01'))
+        self.assertEqual(str(history[1]), 'CLOSED     Jakub Kicinski       2024-03-10 20:01:00')
+        self.assertEqual(len(netnextpredict.load_history(self.datastore)), 3)
+
+    def test_incremental_cursor(self):
+        netnextpredict.get_inbox_history(self.datastore, self.tree)
+        self.assertEqual(netnextpredict.metrics.counters[('inbox_commits', ())], 6)
+        netnextpredict.metrics.reset()
+        self.add_message(1, 'net-next is CLOSED', 'Jakub Kicinski', '2024-05-12 18:00')
+        history, changed = netnextpredict.get_inbox_history(self.datastore, self.tree)
+        self.assertTrue(changed)
+        self.assertEqual(str(history[-1].date), '2024-05-12')
+        self.assertEqual(netnextpredict.metrics.counters[('inbox_commits', ())], 1)
+        netnextpredict.metrics.reset()
+        history, changed = netnextpredict.get_inbox_history(self.datastore, self.tree)
+        self.assertFalse(changed)
+        self.assertEqual(len(history), 4)
+        self.assertNotIn(('inbox_commits', ()), netnextpredict.metrics.counters)
+
+    def test_backfill(self):
+        history, changed = netnextpredict.get_inbox_history(self.datastore, self.tree)
+        netnextpredict.save_datastore(self.datastore, [history[0], history[2]], replace=True)
+        os.unlink(os.path.join(os.path.dirname(self.datastore), 'inboxcursor.yaml'))
+        history, changed = netnextpredict.get_inbox_history(self.datastore, self.tree)
+        self.assertTrue(changed)
+        self.assertEqual(len(history), 3)
+        self.assertEqual(len(netnextpredict.load_history(self.datastore)), 3)
+        history, changed = netnextpredict.get_inbox_history(self.datastore, self.tree)
+        self.assertFalse(changed)
+        self.assertEqual([str(item.date) for item in history], ['2024-01-08', '2024-03-10', '2024-03-25'])
+
+    def test_inbox_bodies(self):
+        history, changed = netnextpredict.get_inbox_history(self.datastore, self.tree)
+        bodypath = os.path.join(self.tmpdir.name, 'out', 'bodies.sqlite')
+        with netnextpredict.BodyCache(bodypath) as cache:
+            self.assertEqual(len(cache.bodies()), 3)
+        # The bodies come from the inbox, lore.kernel.org is never asked for them
+        with unittest.mock.patch.object(netnextpredict.pool, 'inflated_chunks', side_effect=AssertionError):
+            announcements = netnextpredict.get_announcements(history, bodypath, self.tree)
+        self.assertEqual(announcements, {datetime.date(2024, 3, 25): 'Open'})
+        # A store without its body cache gets the bodies from a new walk of the whole inbox
+        os.unlink(bodypath)
+        history, changed = netnextpredict.get_inbox_history(self.datastore, self.tree)
+        self.assertFalse(changed)
+        self.assertEqual(netnextpredict.get_announcements(history, bodypath, self.tree, False), announcements)
+
+    def test_inbox_pull_requests(self):
+        with unittest.mock.patch.object(netnextpredict, 'crawl_lore', side_effect=AssertionError):
+            history, changed, prs, tags, status = netnextpredict.fetch_all(True, stalepath=self.datastore,
+                                                                           tree=self.tree)
+        self.assertEqual(len(history), 3)
+        self.assertEqual([(str(item.date), item.state) for item in prs], [('2024-03-21', '6.9-rc1')])
+
+    def test_packed_epochs(self):
+        for epoch in ['0.git', '1.git']:
+            git(os.path.join(self.inbox, 'git', epoch), 'gc', '-q')
+        history, changed = netnextpredict.get_inbox_history(self.datastore, self.tree)
+        self.assertEqual(len(history), 3)
+
+    def test_missing_inbox(self):
+        netnextpredict.get_inbox_history(self.datastore, self.tree)
+        tree = netnextpredict.NetNextTree(inbox=os.path.join(self.tmpdir.name, 'missing'))
+        history, changed, status = netnextpredict.fetch_history(None, self.datastore, tree)
+        self.assertEqual(len(history), 3)
+        self.assertEqual(status['status'], 'stale')
+
+
+class TestLinuxVersions(unittest.TestCase):
+    def tag(self, day, version):
+        return netnextpredict.LinuxTag(datetime.date.fromisoformat(day), f'v{version}-rc1', f'Linux {version}')
+
+    def test_resolve(self):
+        tags = [self.tag('2023-11-12', '6.7'), self.tag('2023-09-10', '6.6'), self.tag('2024-01-21', '6.8')]
+        cycles = [
+            netnextpredict.NetNextCycle(datetime.date(2023, 7, 10), datetime.date(2023, 8, 28), datetime.date(2023, 9, 11)),
+            netnextpredict.NetNextCycle(datetime.date(2023, 9, 11), datetime.date(2023, 10, 30), datetime.date(2023, 11, 25)),
+            netnextpredict.NetNextCycle(datetime.date(2023, 11, 25), datetime.date(2024, 1, 8), datetime.date(2024, 1, 20)),
+            netnextpredict.PredictedNetNextCycle(datetime.date(2024, 1, 20), 63, 14),
+            netnextpredict.PredictedNetNextCycle(datetime.date(2024, 4, 6), 63, 14),
+        ]
+        netnextpredict.add_linux_versions(cycles, tags)
+        self.assertEqual([cycle.version for cycle in cycles],
+                         ['Linux 6.6', 'Linux 6.7', 'Linux 6.8', 'Linux 6.9', 'Linux 6.10'])
+        self.assertEqual([tag.version for tag in tags], ['Linux 6.7', 'Linux 6.6', 'Linux 6.8'])
+
+    def test_next_version(self):
+        self.assertEqual(netnextpredict.LinuxTag.next_version('Linux 4.19'), 'Linux 5.0')
+        self.assertEqual(netnextpredict.LinuxTag.next_version('Linux 6.1'), 'Linux 6.2')
+
+
+class TestPredictionModels(unittest.TestCase):
+    def setUp(self):
+        self.history = synthetic_history()
+        self.today = self.history[-1].date + datetime.timedelta(days=3)
+        rnd = random.Random(7)
+        self.varied = []
+        day = datetime.date(2018, 9, 3)
+        for idx in range(30):
+            self.varied.append(netnextpredict.NetNextStateChange('net-next is Open', str(day)))
+            day += datetime.timedelta(days=rnd.randint(45, 70))
+            self.varied.append(netnextpredict.NetNextStateChange('net-next is Closed', str(day)))
+            day += datetime.timedelta(days=rnd.randint(12, 16))
+        self.varied.append(netnextpredict.NetNextStateChange('net-next is Open', str(day)))
+
+    def test_models_agree_on_regular_cycles(self):
+        expected = [(cycle.day1, cycle.day2, cycle.day3)
+                    for cycle in netnextpredict.build_cycles(self.history, self.today) if cycle.predicted]
+        for model in ['median', 'weighted', 'montecarlo']:
+            cycles = netnextpredict.build_cycles(self.history, self.today, model=model)
+            self.assertEqual([(cycle.day1, cycle.day2, cycle.day3) for cycle in cycles if cycle.predicted], expected)
+
+    def test_montecarlo_bands(self):
+        cycles = netnextpredict.generate_netnext_cycles(self.varied)
+        today = self.varied[-1].date + datetime.timedelta(days=40)
+        simulation = netnextpredict.MonteCarloPrediction(cycles, self.varied, today, samples=20000, seed=1)
+        predicted = simulation.cycles()
+        self.assertEqual(len(predicted), 3)
+        self.assertEqual(predicted[0].day1, self.varied[-1].date)
+        for cycle in predicted:
+            self.assertLessEqual(cycle.day2_range[0], cycle.day2)
+            self.assertLessEqual(cycle.day2, cycle.day2_range[1])
+            self.assertLessEqual(cycle.day3_range[0], cycle.day3)
+            self.assertLessEqual(cycle.day3, cycle.day3_range[1])
+        # Net-next has been open for 40 days and the shortest open period is 45 days
+        self.assertGreater(predicted[0].day2_range[0], today)
+        probabilities = simulation.open_probability()
+        self.assertEqual(probabilities[0], (today, 1.0))
+        self.assertTrue(all([0.0 <= prob <= 1.0 for day, prob in probabilities]))
+
+
+    def test_announced_constraints(self):
+        closed = self.history[-1].date
+        announced = {closed + datetime.timedelta(days=10): 'Open', closed - datetime.timedelta(days=3): 'Open'}
+        for model in ['average', 'montecarlo']:
+            cycles = netnextpredict.build_cycles(self.history, self.today, model=model, constraints=announced)
+            predicted = [cycle for cycle in cycles if cycle.predicted]
+            self.assertEqual(predicted[0].day3, closed + datetime.timedelta(days=10), model)
+            self.assertEqual(predicted[1].day1, predicted[0].day3, model)
+            self.assertEqual(predicted[1].day2, predicted[1].day1 + datetime.timedelta(days=63), model)
+        self.assertEqual(predicted[0].day3_range, (predicted[0].day3, predicted[0].day3))
+
+    def test_announced_closing(self):
+        history = self.history[:-1]
+        today = history[-1].date + datetime.timedelta(days=30)
+        day = history[-1].date + datetime.timedelta(days=70)
+        for model in ['average', 'montecarlo']:
+            cycles = netnextpredict.build_cycles(history, today, model=model, constraints={day: 'Closed'})
+            predicted = [cycle for cycle in cycles if cycle.predicted]
+            self.assertEqual((predicted[0].day2, predicted[0].day3), (day, day + datetime.timedelta(days=14)), model)
+            self.assertEqual(predicted[1].day1, predicted[0].day3, model)
+
+
+class TestBacktest(unittest.TestCase):
+    def test_regular_cycles(self):
+        report = netnextpredict.backtest(synthetic_history())
+        self.assertEqual(set(report['models']), set(['average', 'median', 'weighted', 'montecarlo']))
+        for model, result in report['models'].items():
+            self.assertEqual(result['mae'], 0.0, model)
+            # The days of the first cycle are not evaluated as there is nothing to predict from yet
+            self.assertEqual(result['days'], 10 * 77 + 63)
+
+    def test_late_close(self):
+        history = synthetic_history(cycles=4) + [
+            netnextpredict.NetNextStateChange('net-next is Open', '2022-01-10'),
+            netnextpredict.NetNextStateChange('net-next is Closed', '2022-03-24'),
+        ]
+        report = netnextpredict.backtest(history, models=['average'])
+        transition = report['models']['average']['transitions'][-1]
+        self.assertEqual(transition['date'], '2022-03-24')
+        self.assertEqual(transition['first_error'], -10)
+
+
+class TestCycles(unittest.TestCase):
+    def test_slots(self):
+        items = [
+            netnextpredict.NetNextStateChange('net-next is Open', '2024-01-08'),
+            netnextpredict.NetNextCycle(datetime.date(2024, 1, 8), datetime.date(2024, 3, 10), datetime.date(2024, 3, 25)),
+            netnextpredict.PredictedNetNextCycle(datetime.date(2024, 3, 25), 63, 14),
+            netnextpredict.LinuxTag(datetime.date(2024, 3, 24), 'v6.9-rc1', 'Linux 6.9'),
+        ]
+        for item in items:
+            self.assertFalse(hasattr(item, '__dict__'), item.__class__.__name__)
+
+    def test_open_update(self):
+        cycle = netnextpredict.PredictedNetNextCycle(datetime.date(2024, 3, 25), 63, 14)
+        cycle.open_update(None, datetime.date(2024, 6, 1))
+        self.assertEqual((cycle.day2, cycle.open.days, cycle.closed.days), (datetime.date(2024, 6, 2), 69, 14))
+
+    def test_close_update(self):
+        cycle = netnextpredict.PredictedNetNextCycle(datetime.date(2024, 3, 25), 63, 14)
+        cycle.close_update(datetime.date(2024, 5, 20), datetime.date(2024, 6, 10))
+        self.assertEqual((cycle.day3, cycle.open.days, cycle.closed.days), (datetime.date(2024, 6, 11), 56, 22))
+
+
+class TestCycleIndex(unittest.TestCase):
+    def setUp(self):
+        self.history = synthetic_history()
+        self.today = self.history[-1].date + datetime.timedelta(days=3)
+        self.cycles = netnextpredict.build_cycles(self.history, self.today, None, 0)
+        self.index = netnextpredict.CycleIndex(self.cycles)
+
+    def daily(self):
+        days = {}
+        for cycle in self.cycles:
+            day = cycle.day1
+            while day < cycle.day3:
+                days[day] = day < cycle.day2
+                day += datetime.timedelta(days=1)
+        return days
+
+    def test_same_as_daily_states(self):
+        days = self.daily()
+        rnd = random.Random(1)
+        first = min(days) - datetime.timedelta(days=20)
+        for idx in range(300):
+            start = first + datetime.timedelta(days=rnd.randint(0, len(days) + 40))
+            last = start + datetime.timedelta(days=rnd.randint(0, 300))
+            answer = self.index.range(start, last)
+            inside = [days[start + datetime.timedelta(days=day)] for day in range((last - start).days + 1)
+                      if start + datetime.timedelta(days=day) in days]
+            self.assertEqual((answer['open_days'], answer['closed_days'], answer['unknown_days']),
+                             (sum(inside), len(inside) - sum(inside), answer['days'] - len(inside)))
+            state = self.index.state(start)['state']
+            self.assertEqual(state, None if start not in days else ('Open' if days[start] else 'Closed'))
+
+    def test_queries(self):
+        cycle = self.cycles[0]
+        answers = [self.index.query(query) for query in [str(cycle.day1), {'date': str(cycle.day2)},
+                                                            f'{cycle.day1}..{cycle.day3 - datetime.timedelta(days=1)}']]
+        self.assertEqual([answers[0]['state'], answers[1]['state']], ['Open', 'Closed'])
+        self.assertFalse(answers[0]['predicted'])
+        self.assertEqual((answers[2]['open_days'], answers[2]['closed_days']), (63, 14))
+        self.assertIsNone(self.index.state(datetime.date(2000, 1, 1))['state'])
+
+    def test_probabilities(self):
+        dates, states = netnext_testdata.generate_cycles(30, jitter=6, first=datetime.date(2019, 1, 7), seed=4)
+        history = netnext_testdata.generate_events(dates, states)
+        today = history[-1].date + datetime.timedelta(days=2)
+        index = netnextpredict.CycleIndex(netnextpredict.build_cycles(history, today, None, 0, 'montecarlo'))
+        answer = index.state(today)
+        self.assertTrue(answer['predicted'])
+        self.assertTrue(0.5 <= answer['probability'] <= 1)
+        answer = index.range(today, today + datetime.timedelta(days=120))
+        self.assertLess(abs(answer['expected_open_days'] - answer['open_days']), 20)
+
+    def test_read_queries(self):
+        self.assertEqual(netnextpredict.read_queries(io.StringIO('["2024-01-01", {"date": "2024-02-01"}]')),
+                         ['2024-01-01', {'date': '2024-02-01'}])
+        self.assertEqual(netnextpredict.read_queries(io.StringIO('2024-01-01..2024-01-31\n{"date": "2024-02-01"}\n')),
+                         ['2024-01-01..2024-01-31', {'date': '2024-02-01'}])
+
+
+class TestCycleBuilder(unittest.TestCase):
+    def events(self, *items):
+        return [netnextpredict.NetNextStateChange(f'net-next is {state}', day) for day, state in items]
+
+    def dates(self, cycles):
+        return [(str(cycle.day1), str(cycle.day2), str(cycle.day3)) for cycle in cycles]
+
+    def test_same_as_window(self):
+        history = synthetic_history(cycles=4)
+        self.assertEqual(self.dates(netnextpredict.generate_netnext_cycles(history)),
+                         [('2021-01-04', '2021-03-08', '2021-03-22'), ('2021-03-22', '2021-05-24', '2021-06-07'),
+                          ('2021-06-07', '2021-08-09', '2021-08-23')])
+
+    def test_interim_opening(self):
+        history = self.events(('2023-10-30', 'Open'), ('2023-12-23', 'Closed'), ('2024-01-02', 'Open'),
+                              ('2024-01-05', 'Closed'), ('2024-01-08', 'Open'), ('2024-03-10', 'Closed'),
+                              ('2024-03-25', 'Open'))
+        self.assertEqual(self.dates(netnextpredict.generate_netnext_cycles(history)),
+                         [('2023-10-30', '2023-12-23', '2024-01-08'), ('2024-01-08', '2024-03-10', '2024-03-25')])
+
+    def test_repeated_events(self):
+        history = self.events(('2023-12-20', 'Closed'), ('2024-01-08', 'Open'), ('2024-01-09', 'Open'),
+                              ('2024-03-10', 'Closed'), ('2024-03-11', 'Closed'), ('2024-03-25', 'Open'))
+        self.assertEqual(self.dates(netnextpredict.generate_netnext_cycles(history)),
+                         [('2024-01-08', '2024-03-10', '2024-03-25')])
+
+
+class TestSyntheticHistory(unittest.TestCase):
+    def test_fill_status(self):
+        data = netnext_testdata.generate_testdata({datetime.date(2010, 3, 1): 'Open'})
+        self.assertEqual(len(data), 60)
+        self.assertEqual(data[datetime.date(2010, 2, 20)], 'Open')
+        self.assertEqual(data[datetime.date(2010, 2, 21)], 'Closed')
+
+    def test_interim_openings_fold(self):
+        dates, states = netnext_testdata.generate_cycles(500, jitter=5, interim=0.3, seed=1)
+        self.assertGreater(len(dates), 1000)
+        cycles = netnextpredict.generate_netnext_cycles(netnext_testdata.generate_events(dates, states))
+        self.assertEqual(len(cycles), 499)
+        self.assertTrue(all([58 <= cycle.open.days <= 68 for cycle in cycles]))
+        self.assertTrue(all([9 <= cycle.closed.days <= 19 for cycle in cycles]))
+
+    def test_store_formats(self):
+        dates, states = netnext_testdata.generate_cycles(20, seed=2)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'history.yaml')
+            netnext_testdata.save_fast(filename, netnext_testdata.generate_history(dates, states))
+            history = netnextpredict.load_history(filename)
+        self.assertEqual([(item.date, item.state) for item in history],
+                         [(item.date, item.state) for item in netnext_testdata.generate_events(dates, states)])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'history.sqlite')
+            netnext_testdata.save_history(filename, dates[:4], states[:4])
+            netnext_testdata.save_history(filename, dates, states)
+            self.assertEqual(len(netnextpredict.load_history(filename)), len(dates))
+        status = netnext_testdata.generate_status(dates, states)
+        self.assertEqual(len(status), 19 * 77 + 63 + 1)
+        self.assertEqual(status[datetime.date(2000, 3, 5)], 'Open')
+        self.assertEqual(status[datetime.date(2000, 3, 6)], 'Closed')
+
+
+class TestStatusRuns(unittest.TestCase):
+    def daily(self):
+        dates, states = netnext_testdata.generate_cycles(10, jitter=4, interim=0.3, seed=5)
+        data = netnext_testdata.generate_status(dates, states)
+        # A gap without a status
+        for day in range(3):
+            del data[datetime.date(2000, 5, 1) + datetime.timedelta(days=day)]
+        return data
+
+    def test_lossless(self):
+        data = self.daily()
+        runs = netnext_testdata.StatusRuns.from_daily(data)
+        self.assertLess(len(runs), 50)
+        self.assertEqual(runs.to_daily(), data)
+        day = min(data) - datetime.timedelta(days=1)
+        while day <= max(data) + datetime.timedelta(days=1):
+            self.assertEqual(runs.get(day), data.get(day))
+            day += datetime.timedelta(days=1)
+
+    def test_append_and_set(self):
+        runs = netnext_testdata.StatusRuns()
+        first = datetime.date(2024, 1, 1)
+        for day in range(10):
+            runs.append(first + datetime.timedelta(days=day), 'Open' if day < 7 else 'Closed')
+        self.assertEqual(len(runs), 2)
+        runs.append(first + datetime.timedelta(days=12), 'Closed')
+        self.assertEqual(runs.get(first + datetime.timedelta(days=11)), None)
+        runs.set(first + datetime.timedelta(days=3), 'Closed')
+        self.assertEqual([state for first, last, state in runs.runs()], ['Open', 'Closed', 'Open', 'Closed', 'Closed'])
+
+    def test_files(self):
+        data = self.daily()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'status.csv')
+            netnext_testdata.save_datastore(filename, data)
+            runs = netnext_testdata.load_status(filename)
+            self.assertEqual(runs.to_daily(), data)
+            netnext_testdata.save_status(filename, runs)
+            with open(filename, 'rt') as fobj:
+                self.assertEqual(fobj.readline().strip(), 'start,last,state')
+            self.assertEqual(netnext_testdata.load_status(filename).to_daily(), data)
+            self.assertEqual(os.stat(filename).st_mode & 0o777, 0o666 & ~netnextpredict.umask)
+
+
+class TestCorrections(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, 'corrections.yaml')
+        with open(self.filename, 'wt') as fobj:
+            fobj.write('missing:\n  2024-03-10: Closed\n  2023-12-23: Closed\n'
+                       'excess:\n  2024-01-02: Open\n  2023-12-23: Closed\n')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_apply(self):
+        corrections = netnextpredict.Corrections(self.filename)
+        history = TestCycleBuilder.events(self, ('2023-10-30', 'Open'), ('2023-12-23', 'Closed'),
+                                          ('2024-01-02', 'Open'), ('2024-01-02', 'Open'), ('2024-01-08', 'Open'))
+        self.assertEqual([(str(item.date), item.state) for item in corrections.apply(history)],
+                         [('2023-10-30', 'Open'), ('2024-01-08', 'Open'), ('2024-03-10', 'Closed')])
+
+    def test_shipped_corrections(self):
+        corrections = netnextpredict.Corrections(netnextpredict.corrections_path)
+        self.assertEqual(len(corrections.missing), 10)
+        self.assertIn(datetime.date(2024, 1, 2), corrections.excess)
+
+
+class TestGenerateHtml(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.saved_cachepath = netnextpredict.cachepath
+        netnextpredict.cachepath = os.path.join(self.tmpdir.name, 'cache')
+        netnextpredict.get_environment.cache_clear()
+        self.history = synthetic_history()
+        self.now = datetime.datetime.combine(self.history[-1].date, datetime.time(12, 0))
+        self.index = os.path.join(self.tmpdir.name, 'index.html')
+
+    def tearDown(self):
+        netnextpredict.cachepath = self.saved_cachepath
+        netnextpredict.get_environment.cache_clear()
+        self.tmpdir.cleanup()
+
+    def generate(self, now):
+        cycles = netnextpredict.build_cycles(self.history, now.date())
+        return netnextpredict.generate_html(cycles, now, None, self.tmpdir.name)
+
+    def test_skip_unchanged(self):
+        self.assertTrue(self.generate(self.now))
+        mtime = os.stat(self.index).st_mtime_ns
+        self.assertFalse(self.generate(self.now + datetime.timedelta(hours=6)))
+        self.assertEqual(os.stat(self.index).st_mtime_ns, mtime)
+        self.assertTrue(os.listdir(netnextpredict.cachepath))
+
+    def test_reopen_range(self):
+        cycles = netnextpredict.build_cycles(self.history, self.now.date())
+        predicted = [cycle for cycle in cycles if cycle.predicted][0]
+        predicted.day2_range = (predicted.day2, predicted.day2 + datetime.timedelta(days=7))
+        predicted.day3_range = (predicted.day3, predicted.day3 + datetime.timedelta(days=7))
+        self.assertTrue(netnextpredict.generate_html(cycles, self.now, None, self.tmpdir.name))
+        predicted.day3_range = (predicted.day3, predicted.day3 + datetime.timedelta(days=14))
+        self.assertTrue(netnextpredict.generate_html(cycles, self.now, None, self.tmpdir.name))
+        with open(os.path.join(self.tmpdir.name, 'cycles.json'), 'rt') as fobj:
+            exported = [item for item in json.load(fobj)['cycles'] if item['predicted']][0]
+        self.assertEqual(exported['reopen_range'], [str(day) for day in predicted.day3_range])
+        status = {'status': 'stale', 'error': 'timed out'}
+        self.assertTrue(netnextpredict.generate_html(cycles, self.now, None, self.tmpdir.name, status=status))
+        status = {'status': 'stale', 'error': 'connection refused'}
+        self.assertTrue(netnextpredict.generate_html(cycles, self.now, None, self.tmpdir.name, status=status))
+
+    def test_new_day(self):
+        self.assertTrue(self.generate(self.now))
+        self.assertTrue(self.generate(self.now + datetime.timedelta(days=1)))
+        self.assertEqual(sorted([name for name in os.listdir(self.tmpdir.name) if name.startswith('.index')]),
+                         ['.index.html.sha256'])
+
+    def test_missing_output(self):
+        self.assertTrue(self.generate(self.now))
+        os.unlink(self.index)
+        self.assertTrue(self.generate(self.now))
+        self.assertTrue(os.path.exists(self.index))
+
+    def test_file_mode(self):
+        with unittest.mock.patch('os.umask') as umask:
+            self.assertTrue(self.generate(self.now))
+        umask.assert_not_called()
+        self.assertEqual(os.stat(self.index).st_mode & 0o777, 0o666 & ~netnextpredict.umask)
+
+    def test_tree_title(self):
+        tree = netnextpredict.NetNextTree('bpf-next', title='BpfNext')
+        cycles = netnextpredict.build_cycles(self.history, self.now.date())
+        self.assertTrue(netnextpredict.generate_html(cycles, self.now, None, self.tmpdir.name, tree=tree))
+        with open(self.index, 'rt') as fobj:
+            self.assertIn('<h1>BpfNext Futuroscope</h1>', fobj.read())
+        with open(os.path.join(self.tmpdir.name, 'netnext.ics'), 'rt') as fobj:
+            self.assertIn('SUMMARY:bpf-next is open', fobj.read())
+        self.assertTrue(self.generate(self.now))
+
+    def test_exports(self):
+        self.assertTrue(self.generate(self.now))
+        with open(os.path.join(self.tmpdir.name, 'cycles.json'), 'rt') as fobj:
+            data = json.load(fobj)
+        cycles = netnextpredict.build_cycles(self.history, self.now.date())
+        self.assertEqual(len(data['cycles']), len(cycles))
+        self.assertEqual(data['cycles'][0], {'open': '2021-01-04', 'close': '2021-03-08', 'reopen': '2021-03-22',
+                                             'open_days': 63, 'closed_days': 14, 'predicted': False,
+                                             'version': None})
+        self.assertTrue(data['cycles'][-1]['predicted'])
+        with open(os.path.join(self.tmpdir.name, 'netnext.ics'), 'rb') as fobj:
+            ics = fobj.read().decode()
+        self.assertTrue(ics.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertEqual(ics.count('BEGIN:VEVENT'), 2 * len(cycles))
+        self.assertIn('DTSTART;VALUE=DATE:20210104\r\nDTEND;VALUE=DATE:20210308\r\n', ics)
+
+    def test_missing_export(self):
+        self.assertTrue(self.generate(self.now))
+        os.unlink(os.path.join(self.tmpdir.name, 'netnext.ics'))
+        self.assertTrue(self.generate(self.now))
+
+
+class TestDaemon(LoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.saved_cachepath = netnextpredict.cachepath
+        netnextpredict.cachepath = os.path.join(self.tmpdir.name, 'cache')
+        netnextpredict.get_environment.cache_clear()
+        netnextpredict.save_datastore(self.datastore, synthetic_history(cycles=3, first=datetime.date(2023, 4, 24)))
+
+    def tearDown(self):
+        netnextpredict.cachepath = self.saved_cachepath
+        netnextpredict.get_environment.cache_clear()
+        super().tearDown()
+
+    def test_poll(self):
+        daemon = netnextpredict.NetNextDaemon(self.tmpdir.name, jitter=0)
+        daemon.now = lambda: datetime.datetime(2024, 4, 1, 12, 0)
+        self.assertTrue(daemon.poll())
+        self.assertEqual(str(daemon.history[-1].date), '2024-03-25')
+        self.assertEqual(len(netnextpredict.load_history(self.datastore)), len(daemon.history))
+        # Nothing changed on lore and it is still the same day: a single 304 and no render
+        self.assertFalse(daemon.poll())
+        self.assertEqual(len(LoreHandler.requests), 2)
+        daemon.now = lambda: datetime.datetime(2024, 4, 2, 12, 0)
+        self.assertTrue(daemon.poll())
+        self.assertEqual(daemon.delay(), 3600)
+
+    def test_tree_daemons_profile(self):
+        daemons = []
+        for name in ['net-next', 'net-next-mirror']:
+            tree = netnextpredict.NetNextTree(name, outdir=os.path.join(self.tmpdir.name, name))
+            daemon = netnextpredict.NetNextDaemon(tree.outdir, jitter=0, tree=tree, deadline=30)
+            daemon.now = lambda: datetime.datetime(2024, 4, 1, 12, 0)
+            daemons.append(daemon)
+        profile = os.path.join(self.tmpdir.name, 'netnextpredict.prom')
+        netnextpredict.run_daemons(daemons, profile, rounds=1)
+        with open(profile, 'rt') as fobj:
+            lines = fobj.read().splitlines()
+        # One textfile for the round with the polls of both trees
+        self.assertIn('netnextpredict_stage_calls{stage="render"} 2', lines)
+        for daemon in daemons:
+            self.assertTrue(os.path.exists(os.path.join(daemon.outdir, 'index.html')))
+
+
+class TestAssets(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.saved_cachepath = netnextpredict.cachepath
+        netnextpredict.cachepath = os.path.join(self.tmpdir.name, 'cache')
+        netnextpredict.get_environment.cache_clear()
+
+    def tearDown(self):
+        netnextpredict.cachepath = self.saved_cachepath
+        netnextpredict.get_environment.cache_clear()
+        self.tmpdir.cleanup()
+
+    def test_build_assets(self):
+        assets = netnextpredict.build_assets(self.tmpdir.name, background_width=320)
+        for name in netnextpredict.asset_sources:
+            self.assertRegex(assets[name], netnextpredict.re_hashed_asset)
+            self.assertTrue(os.path.exists(os.path.join(self.tmpdir.name, assets[name])))
+        css = os.path.join(self.tmpdir.name, assets['css/bootstrap.min.css'])
+        with open(css, 'rb') as fobj, gzip.open(f'{css}.gz', 'rb') as compressed:
+            self.assertEqual(fobj.read(), compressed.read())
+        if 'images/background.webp' in assets:
+            background = os.path.join(self.tmpdir.name, assets['images/background.jpg'])
+            self.assertLess(os.stat(background).st_size, 2110870)
+        self.assertEqual(netnextpredict.build_assets(self.tmpdir.name, background_width=320), assets)
+
+    def test_stale_precompressed(self):
+        history = synthetic_history()
+        now = datetime.datetime.combine(history[-1].date, datetime.time(12, 0))
+        assets = netnextpredict.build_assets(self.tmpdir.name, background_width=320)
+        cycles = netnextpredict.build_cycles(history, now.date())
+        netnextpredict.generate_html(cycles, now, None, self.tmpdir.name, assets)
+        index = os.path.join(self.tmpdir.name, 'index.html')
+        self.assertTrue(os.path.exists(f'{index}.gz'))
+        netnextpredict.generate_html(cycles, now + datetime.timedelta(days=1), None, self.tmpdir.name)
+        for name in ['index.html', 'cycles.json', 'netnext.ics']:
+            self.assertFalse(os.path.exists(os.path.join(self.tmpdir.name, f'{name}.gz')))
+            self.assertFalse(os.path.exists(os.path.join(self.tmpdir.name, f'{name}.br')))
+
+    def test_serve(self):
+        history = synthetic_history()
+        now = datetime.datetime.combine(history[-1].date, datetime.time(12, 0))
+        assets = netnextpredict.build_assets(self.tmpdir.name, background_width=320)
+        netnextpredict.generate_html(netnextpredict.build_cycles(history, now.date()), now, None, self.tmpdir.name,
+                                     assets)
+        server, thread = netnextpredict.start_server(self.tmpdir.name, 0, '127.0.0.1')
+        try:
+            base = f'http://127.0.0.1:{server.server_address[1]}'
+            request = urllib.request.Request(f'{base}/', headers={'Accept-Encoding': 'gzip'})
+            with urllib.request.urlopen(request) as response:
+                self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+                self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+                page = gzip.decompress(response.read()).decode()
+                etag = response.headers['ETag']
+            self.assertIn(assets['css/bootstrap.min.css'], page)
+            request = urllib.request.Request(f'{base}/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+            with self.assertRaises(urllib.error.HTTPError) as err:
+                urllib.request.urlopen(request)
+            self.assertEqual(err.exception.code, 304)
+            with urllib.request.urlopen(f'{base}/{assets["images/favicon.png"]}') as response:
+                self.assertIn('immutable', response.headers['Cache-Control'])
+                self.assertEqual(response.headers['Content-Type'], 'image/png')
+            with self.assertRaises(urllib.error.HTTPError) as err:
+                urllib.request.urlopen(f'{base}/../history.yaml')
+            self.assertEqual(err.exception.code, 404)
+            with urllib.request.urlopen(f'{base}/cycles.json.gz') as response:
+                self.assertEqual(response.status, 200)
+            netnextpredict.save_datastore(os.path.join(self.tmpdir.name, 'history.sqlite'), history)
+            for name in ['history.sqlite', '.index.html.sha256', 'css/../history.sqlite']:
+                with self.assertRaises(urllib.error.HTTPError) as err:
+                    urllib.request.urlopen(f'{base}/{name}')
+                self.assertEqual(err.exception.code, 404)
+        finally:
+            server.shutdown()
+            server.server_close()
+